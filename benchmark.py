@@ -0,0 +1,322 @@
+import argparse
+import contextlib
+import io
+import json
+import multiprocessing as mp
+import os
+import platform
+import resource
+import shutil
+import sys
+import tempfile
+import time
+import pandas as pd
+import numpy as np
+from dump_dataset import ingest
+from loader import DBConnector, TrainDataloader, FunctionDataloader, TestDataloader, table_cache
+from train import Trainer, benchmark_sharded_training
+from test import Tester
+from visualizer import ErrorAnalyzer
+
+STAGES = ["ingest", "load", "train", "dump_ideal", "match", "save_matched", "analyze"]
+
+
+def generate_dataset(dataset_dir, rows=400, ideal_functions=50, train_functions=4, test_points=100, noise=0.2,
+                     outlier_fraction=0.1, seed=0):
+    """ write train.csv, ideal.csv and test.csv in the layout ingest() expects
+
+    Ideal functions are random mixes of a sine, a line and a constant on a shared x grid. Each
+    training column is one of them plus gaussian noise; test points sit on the chosen functions
+    with twice that noise, and outlier_fraction of them are shifted far enough not to match.
+
+    Args:
+        dataset_dir (str): output directory, created if missing
+        rows (int, optional): x values per table. Defaults to 400.
+        ideal_functions (int, optional): candidate columns in ideal.csv. Defaults to 50.
+        train_functions (int, optional): columns in train.csv. Defaults to 4.
+        test_points (int, optional): rows in test.csv, drawn with replacement past rows. Defaults to 100.
+        noise (float, optional): standard deviation of the training noise. Defaults to 0.2.
+        outlier_fraction (float, optional): share of test points pushed off every function. Defaults to 0.1.
+        seed (int, optional): random seed. Defaults to 0.
+
+    Returns:
+        dict: training column -> ideal column it was generated from
+    """
+    os.makedirs(dataset_dir, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    x = np.linspace(-20, 20, rows)
+
+    amplitude, frequency, slope, offset = rng.normal(size=(4, ideal_functions))
+    ideal_values = amplitude * np.sin(np.outer(x, frequency)) + np.outer(x / 10, slope) + offset
+    ideal_names = [f"y{i + 1}" for i in range(ideal_functions)]
+    pd.DataFrame({"x": x, **dict(zip(ideal_names, ideal_values.T))}).to_csv(os.path.join(dataset_dir, "ideal.csv"), index=False)
+
+    picks = rng.choice(ideal_functions, train_functions, replace=False)
+    train_values = ideal_values[:, picks] + rng.normal(scale=noise, size=(rows, train_functions))
+    train_names = [f"y{j + 1}" for j in range(train_functions)]
+    pd.DataFrame({"x": x, **dict(zip(train_names, train_values.T))}).to_csv(os.path.join(dataset_dir, "train.csv"), index=False)
+
+    test_rows = rng.choice(rows, test_points, replace=test_points > rows)
+    test_y = ideal_values[test_rows, picks[rng.integers(train_functions, size=test_points)]]
+    test_y = test_y + rng.normal(scale=2 * noise, size=test_points)
+    outliers = rng.random(test_points) < outlier_fraction
+    test_y[outliers] += 10 * (1 + noise)
+    pd.DataFrame({"x": x[test_rows], "y": test_y}).to_csv(os.path.join(dataset_dir, "test.csv"), index=False)
+
+    return {train_names[j]: ideal_names[p] for j, p in enumerate(picks)}
+
+
+def time_pipeline(dataset_dir):
+    """ run every pipeline stage once on the dataset in dataset_dir and time it
+
+    The shared table cache is cleared first so "load" measures real reads.
+
+    Returns:
+        dict: stage -> seconds
+    """
+    timings = {}
+
+    @contextlib.contextmanager
+    def timed(stage):
+        start = time.perf_counter()
+        yield
+        timings[stage] = time.perf_counter() - start
+
+    db_path = os.path.join(dataset_dir, "functions.db")
+    table_cache.clear()
+    with contextlib.redirect_stdout(io.StringIO()):
+        with timed("ingest"):
+            ingest(dataset_dir)
+
+        db_connector = DBConnector(db_path=db_path)
+        with timed("load"):
+            train_loader = TrainDataloader(db_connector)
+            function_loader = FunctionDataloader(db_connector)
+            test_loader = TestDataloader(db_connector)
+            train_loader.df, function_loader.df, test_loader.df
+
+        with timed("train"):
+            trainer = Trainer(db_connector, train_loader, function_loader)
+            best_functions = trainer.train()
+        with timed("dump_ideal"):
+            trainer.dump_ideal(best_functions, trainer.max_deviation(best_functions))
+
+        with timed("match"):
+            tester = Tester(db_connector, train_loader, function_loader, test_loader)
+            matched_test_data, _ = tester.match_test_data()
+        with timed("save_matched"):
+            tester.save_matched_data(matched_test_data)
+
+        with timed("analyze"):
+            analyzer = ErrorAnalyzer(db_connector=db_connector)
+            analyzer.compute_statistics()
+            analyzer.save_results(os.path.join(dataset_dir, "test_mapping_results.csv"))
+        db_connector.close()
+    table_cache.clear()
+    return timings
+
+
+def run_suite(sizes, ideal_functions=50, test_points=None, noise=0.2, repeat=3, seed=0, work_dir=None):
+    """ time the pipeline on a sweep of synthetic dataset sizes
+
+    Every size is generated once and timed repeat times from a fresh database; the minimum per
+    stage is kept, which is the least noisy estimate on a shared machine.
+
+    Args:
+        sizes (list): rows per dataset
+        ideal_functions (int, optional): candidate ideal functions. Defaults to 50.
+        test_points (int, optional): test rows. Defaults to rows // 4.
+        noise (float, optional): training noise. Defaults to 0.2.
+        repeat (int, optional): runs per size. Defaults to 3.
+        seed (int, optional): generator seed. Defaults to 0.
+        work_dir (str, optional): scratch directory. Defaults to a temporary directory that is removed afterwards.
+
+    Returns:
+        dict: {"config": ..., "machine": ..., "results": {size label: {stage: seconds}}}
+    """
+    print("===============pipeline benchmark================")
+    scratch = work_dir or tempfile.mkdtemp(prefix="pipeline-bench-")
+    results = {}
+    try:
+        for rows in sizes:
+            label = f"rows={rows}"
+            source_dir = os.path.join(scratch, label, "source")
+            generate_dataset(source_dir, rows, ideal_functions, test_points=test_points or max(rows // 4, 1), noise=noise, seed=seed)
+            best = {}
+            for run in range(repeat):
+                run_dir = os.path.join(scratch, label, f"run{run}")
+                shutil.copytree(source_dir, run_dir)
+                for stage, seconds in time_pipeline(run_dir).items():
+                    best[stage] = min(seconds, best.get(stage, seconds))
+                shutil.rmtree(run_dir)
+            results[label] = best
+            print(f"{label:>14}: " + ", ".join(f"{stage} {best[stage] * 1e3:.1f}ms" for stage in STAGES))
+    finally:
+        if work_dir is None:
+            shutil.rmtree(scratch, ignore_errors=True)
+    print("=================================================")
+
+    return {
+        "config": {"sizes": list(sizes), "ideal_functions": ideal_functions, "test_points": test_points,
+                   "noise": noise, "repeat": repeat, "seed": seed},
+        "machine": {"platform": platform.platform(), "python": platform.python_version(),
+                    "numpy": np.__version__, "pandas": pd.__version__, "cpus": os.cpu_count()},
+        "results": results,
+    }
+
+
+def peak_rss_mib():
+    """ high-water RSS of this process; VmHWM starts over at exec, while ru_maxrss of a
+    spawned child starts at the RSS of the parent it was forked from
+    """
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def loader_footprint(db_path, dtype=None):
+    """ train and match on db_path with loaders of the given dtype; meant to run in a fresh process,
+    since the peak RSS is a process-wide high-water mark
+
+    Returns:
+        dict: peak RSS and the RSS after imports in MiB, seconds, best functions and matched points
+    """
+    baseline = peak_rss_mib()
+    table_cache.clear()
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()), DBConnector(db_path=db_path) as db_connector:
+        train_loader = TrainDataloader(db_connector, dtype=dtype)
+        function_loader = FunctionDataloader(db_connector, dtype=dtype)
+        trainer = Trainer(db_connector, train_loader, function_loader)
+        best_functions = trainer.train()
+        trainer.dump_ideal(best_functions, trainer.max_deviation(best_functions))
+        tester = Tester(db_connector, train_loader, function_loader, TestDataloader(db_connector))
+        matched_test_data, _ = tester.match_test_data()
+    return {"peak_rss_mib": peak_rss_mib(), "import_rss_mib": baseline,
+            "seconds": time.perf_counter() - start, "best_functions": best_functions, "matched": len(matched_test_data)}
+
+
+def run_memory(sizes, ideal_functions=50, test_points=None, noise=0.2, seed=0, dtypes=(None, "float64", "float32")):
+    """ peak RSS of training and matching with the default DataFrame loaders and in compact mode
+
+    Each (size, dtype) runs in its own spawned process on the same generated dataset.
+
+    Returns:
+        dict: size label -> dtype name -> loader_footprint() result
+    """
+    print("===============loader memory benchmark================")
+    scratch = tempfile.mkdtemp(prefix="pipeline-mem-")
+    results = {}
+    ctx = mp.get_context("spawn")
+    try:
+        for rows in sizes:
+            label = f"rows={rows}"
+            dataset_dir = os.path.join(scratch, label)
+            generate_dataset(dataset_dir, rows, ideal_functions, test_points=test_points or max(rows // 4, 1), noise=noise, seed=seed)
+            with contextlib.redirect_stdout(io.StringIO()):
+                ingest(dataset_dir)
+            raw_mib = rows * (ideal_functions + 1) * 8 / 2 ** 20
+            results[label] = {}
+            for dtype in dtypes:
+                with ctx.Pool(1) as pool:
+                    result = pool.apply(loader_footprint, (os.path.join(dataset_dir, "functions.db"), dtype))
+                name = dtype or "dataframe"
+                results[label][name] = result
+                print(f"{label:>14} x {ideal_functions} ideal ({raw_mib:.0f} MiB as float64) {name:>9}: "
+                      f"peak RSS {result['peak_rss_mib']:7.0f} MiB (+{result['peak_rss_mib'] - result['import_rss_mib']:.0f} MiB over imports), "
+                      f"{result['seconds']:.2f}s, {result['matched']} matched")
+            choices = {name: r["best_functions"] for name, r in results[label].items()}
+            if len({json.dumps(c, sort_keys=True) for c in choices.values()}) > 1:
+                print(f"{label:>14}: the modes chose different functions: {choices}")
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+    print("======================================================")
+    return results
+
+
+def compare(current, baseline, tolerance=0.25, min_seconds=0.005):
+    """ find the stages that got slower than the baseline
+
+    A stage regresses when it is more than tolerance slower relative to the baseline and the
+    difference is above min_seconds, so millisecond stages do not fail on timer noise.
+
+    Args:
+        current (dict): run_suite() output
+        baseline (dict): run_suite() output loaded from the baseline file
+        tolerance (float, optional): allowed relative slowdown. Defaults to 0.25.
+        min_seconds (float, optional): allowed absolute slowdown. Defaults to 0.005.
+
+    Returns:
+        list: (size label, stage, baseline seconds, current seconds) for every regression
+    """
+    regressions = []
+    for label, stages in current["results"].items():
+        if label not in baseline["results"]:
+            print(f"{label}: not in the baseline, skipped")
+            continue
+        for stage, seconds in stages.items():
+            reference = baseline["results"][label].get(stage)
+            if reference is None:
+                continue
+            status = "ok"
+            if seconds > reference * (1 + tolerance) and seconds - reference > min_seconds:
+                status = "REGRESSION"
+                regressions.append((label, stage, reference, seconds))
+            print(f"{label:>14} {stage:>13}: {reference * 1e3:9.1f}ms -> {seconds * 1e3:9.1f}ms  {status}")
+    return regressions
+
+
+def run(args):
+    """ run the suite from parsed arguments; returns the process exit code
+    """
+    if args.memory:
+        run_memory([int(size) for size in args.sizes.split(",")], args.ideal, args.test_points, args.noise, args.seed)
+        return 0
+    if args.sharded:
+        worker_counts = [int(workers) for workers in args.workers.split(",")] if args.workers else None
+        for rows in [int(size) for size in args.sizes.split(",")]:
+            print(f"rows={rows}, {args.ideal} ideal functions")
+            benchmark_sharded_training(n_rows=rows, n_ideal=args.ideal, worker_counts=worker_counts)
+        return 0
+    current = run_suite([int(size) for size in args.sizes.split(",")], args.ideal, args.test_points,
+                        args.noise, args.repeat, args.seed)
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(current, f, indent=2)
+        print(f"Baseline saved as {args.save}")
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(current, baseline, args.tolerance, args.min_seconds)
+        if regressions:
+            print(f"{len(regressions)} stage(s) regressed beyond {args.tolerance:.0%}")
+            return 1
+        print("no regressions")
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="time the pipeline stages on synthetic datasets")
+    parser.add_argument("--sizes", default="400,4000,40000", help="comma separated rows per synthetic dataset")
+    parser.add_argument("--ideal", type=int, default=50, help="number of ideal functions")
+    parser.add_argument("--test-points", type=int, default=None, help="test rows. Defaults to rows // 4")
+    parser.add_argument("--noise", type=float, default=0.2, help="standard deviation of the training noise")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per size, the fastest is kept")
+    parser.add_argument("--seed", type=int, default=0, help="generator seed")
+    parser.add_argument("--save", default=None, metavar="PATH", help="write the results as a baseline file")
+    parser.add_argument("--compare", default=None, metavar="PATH", help="fail if a stage regressed against this baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed relative slowdown in compare mode")
+    parser.add_argument("--memory", action="store_true", help="report peak RSS of the DataFrame and compact loader modes instead")
+    parser.add_argument("--min-seconds", type=float, default=0.005, help="allowed absolute slowdown in compare mode")
+    parser.add_argument("--sharded", action="store_true", help="time the sharded top-k search over --workers processes instead")
+    parser.add_argument("--workers", default=None, help="comma separated worker counts for --sharded. Defaults to powers of two up to the CPU count")
+    sys.exit(run(parser.parse_args(argv)))
+
+
+if __name__ == "__main__":
+    main()
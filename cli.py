@@ -0,0 +1,263 @@
+import argparse
+import os
+import sys
+import time
+
+# heavy modules (pandas, numpy, matplotlib) are imported inside the subcommands, so
+# `train` and `match` never pay for matplotlib and --help stays instant
+START = time.perf_counter()
+
+DATASET_DIR = "/Users/lincong/Desktop/python_course/assignment/Dataset"
+
+
+def run_ingest(args):
+    from dump_dataset import DATASETS, ingest
+    from stages import StageCache, file_fingerprint
+    tables = [table_name for table_name, _ in DATASETS]
+    fingerprint = file_fingerprint([os.path.join(args.dataset_dir, csv_name) for _, csv_name in DATASETS])
+
+    cache = StageCache(os.path.join(args.dataset_dir, "functions.db"))
+    ran = cache.run("ingest", fingerprint, lambda: ingest(args.dataset_dir, args.stream, args.chunksize, args.restart, unit_test=args.unit_test),
+              outputs=tables, force=args.force)
+    cache.close()
+    return ran
+
+
+def run_train(args):
+    import train
+    from stages import StageCache, combine_fingerprints, table_token
+    cache = StageCache(args.db)
+    params = {"stream": args.stream, "incremental": args.incremental, "ann": args.ann, "compact": args.compact}
+    fingerprint = combine_fingerprints(table_token(cache.conn, "train_data"), table_token(cache.conn, "ideal_functions"), params)
+
+    def stage():
+        if args.unit_test:
+            train.train_unit_test(args.db, store_dir=args.store)
+        train.main(args.db, stream=args.stream, chunksize=args.chunksize, workers=args.workers,
+                   ann=args.ann, check_recall=args.check_recall, incremental=args.incremental, dtype=args.compact,
+                   store_dir=args.store)
+
+    ran = cache.run("train", fingerprint, stage, outputs=["best_function_mapping"], force=args.force)
+    cache.close()
+    return ran
+
+
+def run_match(args):
+    import test
+    from stages import StageCache, combine_fingerprints, table_fingerprint, table_token
+    cache = StageCache(args.db)
+    # the ideal values enter through the train fingerprint, which already covers ideal_functions;
+    # best_function_mapping has one row per train function, so hashing it outright stays cheap
+    ideal = cache.get("train") or table_token(cache.conn, "ideal_functions")
+    fingerprint = combine_fingerprints(table_fingerprint(cache.conn, ["best_function_mapping"]), table_token(cache.conn, "test_data"),
+                                       ideal, args.thresh, args.compact)
+
+    def stage():
+        test.main(args.db, bulk=args.bulk, workers=args.workers, chunksize=args.chunksize,
+                  match_thresh=args.thresh, unit_test=args.unit_test, dtype=args.compact, store_dir=args.store)
+
+    ran = cache.run("match", fingerprint, stage, outputs=["test_mapping"], force=args.force)
+    cache.close()
+    return ran
+
+
+def run_verify(args):
+    import sqlite3
+    from dump_dataset import verify_ingest
+    conn = sqlite3.connect(args.db)
+    results = verify_ingest(conn, args.tables, deep=args.deep)
+    conn.close()
+    sys.exit(1 if any(results.values()) else 0)
+
+
+def run_report(args):
+    from loader import DBConnector
+    from visualizer import Visualizer
+    with DBConnector(db_path=args.db, store_dir=args.store) as db_connector:
+        Visualizer(db_connector, method=args.method, chunksize=args.chunksize).report(bins=args.bins, filename=args.output)
+
+
+def run_plot(args):
+    from loader import DBConnector, TrainDataloader, FunctionDataloader, TestDataloader
+    from visualizer import Visualizer
+    density = {"auto": None, "on": True, "off": False}[args.density]
+
+    def output(name):
+        return os.path.join(args.output_dir, f"{name}.png") if args.output_dir else None
+
+    if args.output_dir:
+        os.makedirs(args.output_dir, exist_ok=True)
+    with DBConnector(db_path=args.db, store_dir=args.store) as db_connector:
+        if args.tables:
+            for loader_class in (TrainDataloader, FunctionDataloader, TestDataloader):
+                loader = loader_class(db_connector)
+                loader.viz_df(output=output(loader.table_name), density=density, bins=args.bins)
+        visualizer = Visualizer(db_connector)
+        visualizer.plotter.plot_test_vs_ideal(visualizer.load_unmatched(), output=output("test_vs_ideal"),
+                                              density=density, bins=args.bins)
+
+
+def run_serve(args):
+    import asyncio
+    import service
+    match_service = service.MatchService(args.db, match_thresh=args.thresh, max_batch=args.max_batch,
+                                         max_delay=args.max_delay_ms / 1000, reload_interval=args.reload_interval,
+                                         store_dir=args.store)
+    address = {"host": args.host, "port": args.port, "socket_path": args.socket}
+    try:
+        if args.bench:
+            asyncio.run(service.serve_and_benchmark(match_service, **address, clients=args.clients,
+                                                    requests=args.requests, points=args.points))
+        else:
+            asyncio.run(service.serve(match_service, **address))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        match_service.close()
+
+
+def run_fleet(args):
+    import fleet
+    dataset_dirs = fleet.read_manifest(args.manifest)
+    compact = ["--compact", args.compact] if args.compact else []
+    stage_args = {"ingest": ["--stream"] if args.stream else [], "train": compact, "match": compact}
+    results = fleet.run_fleet(dataset_dirs, workers=args.workers, timeout=args.timeout, stage_args=stage_args,
+                              force=args.force, threads=args.threads, log_name=args.log_name)
+    if args.summary:
+        fleet.save_summary(results, args.summary)
+    sys.exit(fleet.exit_code(results))
+
+
+def run_bench(args):
+    import benchmark
+    benchmark.main(args.bench_args)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="ideal function matching pipeline")
+    parser.add_argument("--timing", action="store_true", help="print startup and command wall time")
+    parser.add_argument("--metrics", default=None, metavar="PATH", help="append per-stage metrics as JSON lines to PATH ('-' for stdout)")
+    parser.add_argument("--profile", default=None, metavar="STAGES", help="comma separated stages to run under cProfile, or 'all'")
+    parser.add_argument("--profile-dir", default=".", help="where the .prof files are written")
+    parser.add_argument("--tracemalloc", action="store_true", help="report the traced memory peak of each stage")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    ingest = subparsers.add_parser("ingest", help="load the csv files into functions.db")
+    ingest.add_argument("--dataset-dir", default=DATASET_DIR, help="directory holding the csv files and functions.db")
+    ingest.add_argument("--stream", action="store_true", help="chunked, resumable load")
+    ingest.add_argument("--chunksize", type=int, default=100000, help="rows per chunk/transaction in streaming mode")
+    ingest.add_argument("--restart", action="store_true", help="ignore an interrupted streaming load and start over")
+    ingest.add_argument("--unit-test", action="store_true", help="verify the loaded tables against the checksums recorded while loading")
+    ingest.add_argument("--force", action="store_true", help="run even if the inputs did not change")
+    ingest.set_defaults(func=run_ingest)
+
+    db_default = os.environ.get("PIPELINE_DB", os.path.join(DATASET_DIR, "functions.db"))
+    store_default = os.environ.get("PIPELINE_STORE") or None
+    store_help = "read train/test/ideal from this column store (dump_columnar.py) instead of SQL"
+
+    train = subparsers.add_parser("train", help="find the best ideal function for each training column")
+    train.add_argument("--db", default=db_default, help="database file")
+    train.add_argument("--store", default=store_default, metavar="DIR", help=store_help)
+    train.add_argument("--stream", action="store_true", help="out-of-core streaming trainer")
+    train.add_argument("--incremental", action="store_true", help="only process train rows not seen before")
+    train.add_argument("--chunksize", type=int, default=100000, help="rows per chunk in streaming/incremental mode")
+    train.add_argument("--workers", type=int, default=1, help="processes for sharded training")
+    train.add_argument("--ann", action="store_true", help="approximate search with exact re-ranking")
+    train.add_argument("--check-recall", action="store_true", help="report ANN recall@1 against the exact search")
+    train.add_argument("--compact", choices=["float32", "float64"], default=None, help="load the tables as one contiguous array of this dtype")
+    train.add_argument("--unit-test", action="store_true", help="run train_unit_test first")
+    train.add_argument("--force", action="store_true", help="run even if the inputs did not change")
+    train.set_defaults(func=run_train)
+
+    match = subparsers.add_parser("match", help="match the test points against the chosen ideal functions")
+    match.add_argument("--db", default=db_default, help="database file")
+    match.add_argument("--store", default=store_default, metavar="DIR", help=store_help)
+    match.add_argument("--bulk", action="store_true", help="out-of-core pipelined matcher")
+    match.add_argument("--workers", type=int, default=None, help="matcher processes in bulk mode")
+    match.add_argument("--chunksize", type=int, default=100000, help="test rows per chunk in bulk mode")
+    match.add_argument("--thresh", type=float, default=2 ** 0.5, help="threshold factor on the max deviation")
+    match.add_argument("--compact", choices=["float32", "float64"], default=None, help="load the train and ideal tables as one contiguous array of this dtype")
+    match.add_argument("--unit-test", action="store_true", help="run test_unit_test and the online matcher benchmark")
+    match.add_argument("--force", action="store_true", help="run even if the inputs did not change")
+    match.set_defaults(func=run_match)
+
+    verify = subparsers.add_parser("verify", help="check the ingested tables against the checksums recorded by ingest")
+    verify.add_argument("--db", default=db_default, help="database file")
+    verify.add_argument("--tables", nargs="+", default=None, help="tables to check. Defaults to train_data, test_data and ideal_functions")
+    verify.add_argument("--deep", action="store_true", help="compare the sha256 of every chunk instead of the SQLite summaries")
+    verify.set_defaults(func=run_verify)
+
+    report = subparsers.add_parser("report", help="print error statistics and export test_mapping to csv")
+    report.add_argument("--db", default=db_default, help="database file")
+    report.add_argument("--store", default=store_default, metavar="DIR", help=store_help)
+    report.add_argument("--method", choices=["sql", "stream"], default="sql", help="SQLite aggregates or one chunked Welford pass")
+    report.add_argument("--bins", type=int, default=10, help="Delta_Y histogram bins")
+    report.add_argument("--chunksize", type=int, default=100000, help="rows per chunk for streaming and the csv export")
+    report.add_argument("--output", default="test_mapping_results.csv", help="csv export path")
+    report.set_defaults(func=run_report)
+
+    plot = subparsers.add_parser("plot", help="plot test data against the matched ideal functions")
+    plot.add_argument("--db", default=db_default, help="database file")
+    plot.add_argument("--store", default=store_default, metavar="DIR", help=store_help)
+    plot.add_argument("--tables", action="store_true", help="also plot train_data, ideal_functions and test_data")
+    plot.add_argument("--output-dir", default=None, metavar="DIR", help="write PNG files (headless) instead of showing the plots")
+    plot.add_argument("--density", choices=["auto", "on", "off"], default="auto", help="2D histogram raster instead of markers; auto above 200k points")
+    plot.add_argument("--bins", type=int, default=512, help="raster bins per axis in density mode")
+    plot.set_defaults(func=run_plot)
+
+    serve = subparsers.add_parser("serve", help="resident match service with micro-batching and hot reload")
+    serve.add_argument("--db", default=db_default, help="database file")
+    serve.add_argument("--store", default=store_default, metavar="DIR", help=store_help)
+    serve.add_argument("--host", default="127.0.0.1", help="TCP address to listen on")
+    serve.add_argument("--port", type=int, default=8765, help="TCP port to listen on")
+    serve.add_argument("--socket", default=None, metavar="PATH", help="listen on a Unix socket instead of TCP")
+    serve.add_argument("--thresh", type=float, default=2 ** 0.5, help="threshold factor on the max deviation")
+    serve.add_argument("--max-batch", type=int, default=4096, help="points per vectorized match call")
+    serve.add_argument("--max-delay-ms", type=float, default=0.0, help="wait this long for more requests before matching a batch")
+    serve.add_argument("--reload-interval", type=float, default=1.0, help="seconds between checks for a changed mapping")
+    serve.add_argument("--bench", action="store_true", help="run a load test against the service on test_data, then exit")
+    serve.add_argument("--clients", type=int, default=32, help="concurrent connections in --bench")
+    serve.add_argument("--requests", type=int, default=200, help="requests per connection in --bench")
+    serve.add_argument("--points", type=int, default=1, help="points per request in --bench")
+    serve.set_defaults(func=run_serve)
+
+    fleet = subparsers.add_parser("fleet", help="ingest, train and match every dataset directory of a manifest in parallel")
+    fleet.add_argument("manifest", help="file listing one dataset directory per line")
+    fleet.add_argument("--workers", type=int, default=None, help="datasets processed at a time. Defaults to the number of cores")
+    fleet.add_argument("--timeout", type=float, default=None, help="seconds before a dataset is killed")
+    fleet.add_argument("--threads", type=int, default=1, help="BLAS/OpenMP threads per dataset")
+    fleet.add_argument("--stream", action="store_true", help="chunked ingest")
+    fleet.add_argument("--compact", choices=["float32", "float64"], default=None, help="compact loaders for train and match")
+    fleet.add_argument("--log-name", default="fleet.log", help="per-dataset log file written in each dataset directory")
+    fleet.add_argument("--summary", default=None, metavar="PATH", help="write the results as JSON")
+    fleet.add_argument("--force", action="store_true", help="rerun stages whose inputs did not change")
+    fleet.set_defaults(func=run_fleet)
+
+    # the options belong to benchmark.py (see python benchmark.py --help) and are passed through as is
+    bench = subparsers.add_parser("bench", add_help=False, help="time every stage on synthetic datasets, optionally against a baseline")
+    bench.set_defaults(func=run_bench)
+    return parser
+
+
+def main(argv=None):
+    parser = build_parser()
+    args, extra = parser.parse_known_args(argv)
+    if args.command == "bench":
+        args.bench_args = extra
+    elif extra:
+        parser.error(f"unrecognized arguments: {' '.join(extra)}")
+    if args.metrics or args.profile or args.tracemalloc:
+        from metrics import metrics
+        metrics.configure(sink=args.metrics, profile=args.profile, profile_dir=args.profile_dir, trace_memory=args.tracemalloc)
+    command_start = time.perf_counter()
+    args.func(args)
+    if "metrics" in sys.modules:
+        sys.modules["metrics"].metrics.flush_counters()
+    if args.timing:
+        now = time.perf_counter()
+        print(f"[timing] {args.command}: startup {command_start - START:.3f}s, command {now - command_start:.3f}s, "
+              f"matplotlib loaded: {'matplotlib' in sys.modules}")
+
+
+if __name__ == "__main__":
+    main()
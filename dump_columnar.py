@@ -0,0 +1,20 @@
+import argparse
+import os
+import time
+from loader import convert_to_columnar
+
+def main():
+    parser = argparse.ArgumentParser(description="convert functions.db into a memory-mapped column store")
+    parser.add_argument("--dataset-dir", default="/Users/lincong/Desktop/python_course/assignment/Dataset", help="directory holding functions.db")
+    parser.add_argument("--store-dir", default=None, help="output directory. Defaults to <dataset-dir>/columnar")
+    parser.add_argument("--chunksize", type=int, default=100000, help="rows per fetch while converting")
+    args = parser.parse_args()
+
+    store_dir = args.store_dir or os.path.join(args.dataset_dir, "columnar")
+
+    start = time.perf_counter()
+    convert_to_columnar(os.path.join(args.dataset_dir, "functions.db"), store_dir, chunksize=args.chunksize)
+    print(f"Column store written to {store_dir} in {time.perf_counter() - start:.2f}s")
+
+if __name__ == "__main__":
+    main()
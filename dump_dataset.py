@@ -1,100 +1,439 @@
+import argparse
+import hashlib
+import itertools
+import json
+import os
+import sys
+import time
+import numpy as np
 import pandas as pd
 import sqlite3
 
-# read csv as dataframe
-train_df = pd.read_csv("/Users/lincong/Desktop/python_course/assignment/Dataset/train.csv")
-test_df = pd.read_csv("/Users/lincong/Desktop/python_course/assignment/Dataset/test.csv")
-ideal_df = pd.read_csv("/Users/lincong/Desktop/python_course/assignment/Dataset/ideal.csv")
-
-# connect to SQLite database
-conn = sqlite3.connect("/Users/lincong/Desktop/python_course/assignment/Dataset/functions.db")
-cursor = conn.cursor()
-
-# create table
-cursor.execute("""
-CREATE TABLE IF NOT EXISTS train_data (
-    X REAL PRIMARY KEY,
-    Y1 REAL,
-    Y2 REAL,
-    Y3 REAL,
-    Y4 REAL
-);
-""")
-
-cursor.execute("""
-CREATE TABLE IF NOT EXISTS test_data (
-    X REAL PRIMARY KEY,
-    Y REAL
-);
-""")
-
-cursor.execute("""
-CREATE TABLE IF NOT EXISTS ideal_functions (
-    X REAL PRIMARY KEY,
-    """ + ", ".join([f"Y{i+1} REAL" for i in range(50)]) + """
-);
-""")
-
-# save dataframes into dataset
-train_df.to_sql("train_data", conn, if_exists="replace", index=False)
-test_df.to_sql("test_data", conn, if_exists="replace", index=False)
-ideal_df.to_sql("ideal_functions", conn, if_exists="replace", index=False)
-
-print("Data loading completed!")
-
-
-def dump_unit_test():
-    """ unit test: sanity check, whether data dumped into database and consistent with original csv file
+DATASET_DIR = "/Users/lincong/Desktop/python_course/assignment/Dataset"
+DATASETS = [("train_data", "train.csv"), ("test_data", "test.csv"), ("ideal_functions", "ideal.csv")]
+
+# x is the lookup key of every table: train/ideal x values are unique and keep the
+# declared primary key, test x values may repeat so test_data gets a plain index
+X_KEYS = {"train_data": "PRIMARY KEY", "test_data": "INDEX", "ideal_functions": "PRIMARY KEY"}
+
+
+def create_checksum_tables(conn):
+    """ chunk_checksums holds a sha256 per run of rows in rowid order, chunk_summaries the same
+    runs summarized by SQLite aggregates (see chunk_summary()), table_checksums the row count,
+    header and a sha256 over the chunk digests of each loaded table
     """
-    print("===============performing unit test================")
-    train_df = pd.read_csv("/Users/lincong/Desktop/python_course/assignment/Dataset/train.csv")
-    cursor.execute("SELECT * FROM train_data LIMIT 1;")
-    row = cursor.fetchone()
-    expected_row = train_df.iloc[0]  
-    sanity_check = True
-    for i in range(len(row)):
-        if row[i] != expected_row.iloc[i]:
-            sanity_check == False
-            break
-
-    if not sanity_check:
-        print("train_df unit test failed. Program exit.")
-        exit()
-    
-    test_df = pd.read_csv("/Users/lincong/Desktop/python_course/assignment/Dataset/test.csv")
-    cursor.execute("SELECT * FROM test_data LIMIT 1;")
-    row = cursor.fetchone()
-    expected_row = test_df.iloc[0]  
-    sanity_check = True
-    for i in range(len(row)):
-        if row[i] != expected_row.iloc[i]:
-            sanity_check == False
-            break
-
-    if not sanity_check:
-        print("test_data unit test failed. Program exit.")
-        exit()
-
-    ideal_df = pd.read_csv("/Users/lincong/Desktop/python_course/assignment/Dataset/ideal.csv")
-    cursor.execute("SELECT * FROM ideal_functions LIMIT 1;")
-    row = cursor.fetchone()
-    expected_row = ideal_df.iloc[0]  
-    sanity_check = True
-    for i in range(len(row)):
-        if row[i] != expected_row.iloc[i]:
-            sanity_check == False
-            break
-
-    if not sanity_check:
-        print("ideal_df unit test failed. Program exit.")
-        exit()
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS chunk_checksums (
+        table_name TEXT,
+        first_row INTEGER,
+        row_count INTEGER,
+        checksum TEXT,
+        PRIMARY KEY (table_name, first_row)
+    );
+    """)
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS chunk_summaries (
+        table_name TEXT,
+        first_row INTEGER,
+        sqlite_version TEXT,
+        summary TEXT,
+        PRIMARY KEY (table_name, first_row)
+    );
+    """)
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS table_checksums (
+        table_name TEXT PRIMARY KEY,
+        columns TEXT,
+        row_count INTEGER,
+        chunk_count INTEGER,
+        checksum TEXT,
+        created_at REAL
+    );
+    """)
+
+
+def chunk_checksum(rows):
+    """ sha256 of a block of rows as float64 bytes, row-major
+
+    The same digest comes out of the values written by ingest and the tuples read back from
+    SQLite: NULL and NaN both hash as the canonical NaN and -0.0 as 0.0.
+
+    Args:
+        rows (np.ndarray or list): 2D block of numeric values, None for NULL
+
+    Returns:
+        str: hex digest
+    """
+    values = np.array(rows, dtype=np.float64) + 0.0
+    values[np.isnan(values)] = np.nan
+    return hashlib.sha256(values.tobytes()).hexdigest()
+
+
+def chunk_summary(conn, table_name, columns, first_row, row_count):
+    """ summary of row_count rows of table_name starting at row first_row, computed inside SQLite
+    without building a Python object per row
+
+    ingest fills a fresh table, so row i has rowid i + 1. The summary is the row count, the
+    TOTAL() of every column and the TOTAL() of each row's sum weighted by its rowid, so a
+    changed value, a NULL, a missing row or rows swapped within the chunk change it. It is not
+    bit-exact like chunk_checksum(): a change below the rounding of the sums goes unnoticed.
+
+    Args:
+        conn (sqlite3.Connection): database connection
+        table_name (str): table loaded by ingest
+        columns (list): the table's columns
+        first_row (int): first row of the chunk, 0-based
+        row_count (int): rows in the chunk
+
+    Returns:
+        str: the aggregates as JSON
+    """
+    quoted = [f'"{c}"' for c in columns]
+    row = conn.execute(f"SELECT COUNT(*), " + ", ".join(f"TOTAL({c})" for c in quoted)
+                       + f", TOTAL(({' + '.join(quoted)}) * rowid) FROM {table_name} WHERE rowid BETWEEN ? AND ?",
+                       (first_row + 1, first_row + row_count)).fetchone()
+    return json.dumps(row)
+
+
+def record_chunk(conn, table_name, first_row, rows):
+    """ store the checksum and the SQLite summary of rows, which start at row first_row of
+    table_name and are already inserted
+    """
+    conn.execute("INSERT OR REPLACE INTO chunk_checksums (table_name, first_row, row_count, checksum) VALUES (?, ?, ?, ?)",
+                 (table_name, first_row, len(rows), chunk_checksum(rows)))
+    columns = [row[1] for row in conn.execute(f"PRAGMA table_info({table_name})")]
+    conn.execute("INSERT OR REPLACE INTO chunk_summaries (table_name, first_row, sqlite_version, summary) VALUES (?, ?, ?, ?)",
+                 (table_name, first_row, sqlite3.sqlite_version, chunk_summary(conn, table_name, columns, first_row, len(rows))))
+
+
+def table_checksum(columns, chunk_digests):
+    """ sha256 over the header and the chunk digests in row order
+    """
+    digest = hashlib.sha256(json.dumps(columns).encode())
+    for chunk_digest in chunk_digests:
+        digest.update(bytes.fromhex(chunk_digest))
+    return digest.hexdigest()
+
+
+def record_table(conn, table_name, columns):
+    """ store the table checksum once all chunks of table_name are recorded
+    """
+    chunks = conn.execute("SELECT row_count, checksum FROM chunk_checksums WHERE table_name = ? ORDER BY first_row", (table_name,)).fetchall()
+    conn.execute("INSERT OR REPLACE INTO table_checksums (table_name, columns, row_count, chunk_count, checksum, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+                 (table_name, json.dumps(columns), sum(row_count for row_count, _ in chunks), len(chunks),
+                  table_checksum(columns, [checksum for _, checksum in chunks]), time.time()))
+
+
+def create_table(conn, table_name, columns):
+    """ (re)create table_name with REAL columns named after the csv header and an index on x,
+    instead of letting to_sql(if_exists="replace") recreate it without one
+
+    Args:
+        conn (sqlite3.Connection): database connection
+        table_name (str): table to create
+        columns (list): csv header, x first
+    """
+    create_checksum_tables(conn)
+    conn.execute("DELETE FROM chunk_checksums WHERE table_name = ?", (table_name,))
+    conn.execute("DELETE FROM chunk_summaries WHERE table_name = ?", (table_name,))
+    conn.execute("DELETE FROM table_checksums WHERE table_name = ?", (table_name,))
+    key = X_KEYS.get(table_name, "INDEX")
+    column_defs = [f'"{columns[0]}" REAL' + (" PRIMARY KEY" if key == "PRIMARY KEY" else "")]
+    column_defs += [f'"{c}" REAL' for c in columns[1:]]
+    conn.execute(f"DROP TABLE IF EXISTS {table_name}")
+    conn.execute(f"CREATE TABLE {table_name} (" + ", ".join(column_defs) + ")")
+    if key == "INDEX":
+        conn.execute(f'CREATE INDEX idx_{table_name}_x ON {table_name} ("{columns[0]}")')
+
+
+def load_full(conn, dataset_dir=DATASET_DIR, chunksize=100000):
+    """ read each csv fully into memory and save it with to_sql, recording checksums of every
+    chunksize rows
+    """
+    for table_name, csv_name in DATASETS:
+        df = pd.read_csv(os.path.join(dataset_dir, csv_name))
+        create_table(conn, table_name, df.columns.tolist())
+        df.to_sql(table_name, conn, if_exists="append", index=False)
+        values = df.to_numpy(dtype=np.float64)
+        for first_row in range(0, len(values), chunksize):
+            record_chunk(conn, table_name, first_row, values[first_row:first_row + chunksize])
+        record_table(conn, table_name, df.columns.tolist())
+    conn.commit()
+
+
+def set_bulk_pragmas(conn):
+    """ switch the connection to write-optimized settings for a bulk load
+
+    Returns:
+        dict: previous pragma values, to pass to restore_pragmas()
+    """
+    previous = {}
+    for pragma in ["journal_mode", "synchronous", "cache_size", "temp_store"]:
+        previous[pragma] = conn.execute(f"PRAGMA {pragma}").fetchone()[0]
+
+    conn.execute("PRAGMA journal_mode=WAL")
+    # NORMAL is crash-consistent in WAL mode, which the resume logic relies on
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA cache_size=-262144")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    return previous
+
+
+def restore_pragmas(conn, previous):
+    """ restore the pragma values saved by set_bulk_pragmas()
+    """
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    for pragma, value in previous.items():
+        conn.execute(f"PRAGMA {pragma}={value}")
+
+
+def stream_csv(conn, table_name, csv_path, chunksize, restart=False):
+    """ stream one csv file into table_name, one transaction per chunk.
+    Progress and the chunk checksum are committed together with each chunk, so an
+    interrupted load resumes after the last committed chunk.
+
+    Args:
+        conn (sqlite3.Connection): database connection
+        table_name (str): destination table
+        csv_path (str): source csv file
+        chunksize (int): rows per chunk
+        restart (bool, optional): drop any interrupted load and start over. Defaults to False.
+
+    Returns:
+        int: number of rows inserted by this call
+    """
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS ingest_progress (
+        table_name TEXT PRIMARY KEY,
+        source TEXT,
+        rows_done INTEGER
+    );
+    """)
+    # a load resumed in a database from before chunk_summaries existed needs the table too
+    create_checksum_tables(conn)
+    progress = conn.execute("SELECT source, rows_done FROM ingest_progress WHERE table_name = ?", (table_name,)).fetchone()
+    columns = pd.read_csv(csv_path, nrows=0).columns.tolist()
+
+    if progress is not None and progress[0] == csv_path and not restart:
+        rows_done = progress[1]
+        print(f"resuming {table_name} from row {rows_done}")
+    else:
+        rows_done = 0
+        conn.execute("BEGIN")
+        create_table(conn, table_name, columns)
+        conn.execute("INSERT OR REPLACE INTO ingest_progress (table_name, source, rows_done) VALUES (?, ?, 0)", (table_name, csv_path))
+        conn.execute("COMMIT")
+
+    insert_sql = f"INSERT INTO {table_name} VALUES (" + ", ".join("?" * len(columns)) + ")"
+    # skip the header and the committed rows on the file handle: skiprows=range(...) would be
+    # turned into a set of rows_done ints by pandas, so memory would grow with the resume point
+    with open(csv_path, newline="") as csv_file:
+        for _ in itertools.islice(csv_file, rows_done + 1):
+            pass
+        reader = pd.read_csv(csv_file, chunksize=chunksize, header=None, names=columns)
+
+        inserted = 0
+        start = time.perf_counter()
+        for chunk in reader:
+            if chunk.empty:
+                # resumed after the last chunk: nothing left, and an empty chunk would change the table checksum
+                break
+            values = chunk.to_numpy(dtype=float)
+            rows = values.tolist()
+            conn.execute("BEGIN")
+            try:
+                conn.executemany(insert_sql, rows)
+                record_chunk(conn, table_name, rows_done + inserted, values)
+                conn.execute("UPDATE ingest_progress SET rows_done = rows_done + ? WHERE table_name = ?", (len(rows), table_name))
+                conn.execute("COMMIT")
+            except BaseException:
+                # BaseException: a Ctrl-C must not leave the chunk's transaction open either
+                if conn.in_transaction:
+                    conn.execute("ROLLBACK")
+                raise
+            inserted += len(rows)
 
+    conn.execute("BEGIN")
+    record_table(conn, table_name, columns)
+    conn.execute("DELETE FROM ingest_progress WHERE table_name = ?", (table_name,))
+    conn.execute("COMMIT")
+
+    elapsed = time.perf_counter() - start
+    print(f"{table_name}: {inserted} rows in {elapsed:.2f}s ({inserted / max(elapsed, 1e-9):.0f} rows/s)")
+    return inserted
+
+
+def load_streaming(conn, chunksize, restart=False, dataset_dir=DATASET_DIR):
+    """ stream every csv into the database with write-optimized settings.
+    The connection runs in autocommit mode so each chunk's BEGIN/COMMIT is explicit.
+    """
+    conn.commit()
+    conn.isolation_level = None
+    previous = set_bulk_pragmas(conn)
+    try:
+        for table_name, csv_name in DATASETS:
+            stream_csv(conn, table_name, os.path.join(dataset_dir, csv_name), chunksize, restart)
+    finally:
+        # an interruption outside a chunk's try block can still leave a transaction open,
+        # and journal_mode can't be changed inside one
+        if conn.in_transaction:
+            conn.execute("ROLLBACK")
+        restore_pragmas(conn, previous)
+        conn.isolation_level = ""
+
+
+def ingest(dataset_dir=DATASET_DIR, stream=False, chunksize=100000, restart=False, unit_test=False):
+    """ load train.csv, test.csv and ideal.csv from dataset_dir into dataset_dir/functions.db
+
+    Args:
+        dataset_dir (str, optional): directory holding the csv files and functions.db. Defaults to DATASET_DIR.
+        stream (bool, optional): chunked, resumable load instead of full in-memory frames. Defaults to False.
+        chunksize (int, optional): rows per chunk/transaction in streaming mode and per checksum. Defaults to 100000.
+        restart (bool, optional): ignore an interrupted streaming load and start over. Defaults to False.
+        unit_test (bool, optional): verify the loaded tables against their checksums afterwards. Defaults to False.
+    """
+    conn = sqlite3.connect(os.path.join(dataset_dir, "functions.db"))
+
+    # save dataframes into dataset
+    if stream:
+        load_streaming(conn, chunksize, restart, dataset_dir)
     else:
-        print("unit test passed!")
+        load_full(conn, dataset_dir, chunksize)
+
+    print("Data loading completed!")
 
+    if unit_test:
+        dump_unit_test(conn)
+    conn.close()
+
+
+def verify_table(conn, table_name, deep=False):
+    """ check table_name against what ingest recorded, a chunk at a time
+
+    By default every chunk is compared with its chunk_summary(), which SQLite computes without
+    handing rows to Python. deep recomputes the sha256 of every chunk in one scan in rowid
+    order instead, which also catches changes below the rounding of the sums; it is used as
+    well for tables whose summaries are missing or were recorded by another SQLite version,
+    whose TOTAL() may round differently.
+
+    Args:
+        conn (sqlite3.Connection): database connection
+        table_name (str): table loaded by ingest()
+        deep (bool, optional): compare the sha256 of every chunk. Defaults to False.
+
+    Returns:
+        tuple: (rows scanned, list of problems, empty if the table matches what was loaded)
+    """
+    record = conn.execute("SELECT columns, row_count, checksum FROM table_checksums WHERE table_name = ?", (table_name,)).fetchone()
+    if record is None:
+        return 0, ["no checksums recorded; the load did not finish or predates checksums"]
+    columns, row_count, expected = json.loads(record[0]), record[1], record[2]
+    chunks = conn.execute("SELECT first_row, row_count, checksum FROM chunk_checksums WHERE table_name = ? ORDER BY first_row", (table_name,)).fetchall()
+
+    problems = []
+    actual_columns = [row[1] for row in conn.execute(f"PRAGMA table_info({table_name})")]
+    if actual_columns != columns:
+        problems.append(f"columns {actual_columns} differ from the loaded header {columns}")
+
+    try:
+        summaries = dict(conn.execute("SELECT first_row, summary FROM chunk_summaries WHERE table_name = ? AND sqlite_version = ?",
+                                      (table_name, sqlite3.sqlite_version)).fetchall())
+    except sqlite3.OperationalError:
+        summaries = {}
+    if not deep and (problems or set(summaries) != {first_row for first_row, _, _ in chunks}):
+        if not problems:
+            print(f"{table_name}: no chunk summaries from SQLite {sqlite3.sqlite_version}, checking the sha256 of every chunk")
+        deep = True
+
+    scanned = 0
+    if deep:
+        cursor = conn.execute(f"SELECT * FROM {table_name} ORDER BY rowid")
+        digests = []
+        for first_row, count, checksum in chunks:
+            if first_row != scanned:
+                problems.append(f"chunk checksums skip rows {scanned}-{first_row - 1}")
+            rows = cursor.fetchmany(count)
+            scanned = first_row + len(rows)
+            digests.append(chunk_checksum(rows))
+            if len(rows) < count:
+                problems.append(f"rows {first_row}-{first_row + count - 1}: table ends after {len(rows)} of them, {row_count - scanned} rows missing")
+                break
+            if digests[-1] != checksum:
+                problems.append(f"rows {first_row}-{first_row + count - 1}: checksum mismatch")
+        extra = len(cursor.fetchall())
+    else:
+        digests = [checksum for _, _, checksum in chunks]
+        end = 0
+        for first_row, count, _ in chunks:
+            if first_row != end:
+                problems.append(f"chunk checksums skip rows {end}-{first_row - 1}")
+            summary = chunk_summary(conn, table_name, columns, first_row, count)
+            rows = json.loads(summary)[0]
+            scanned += rows
+            end = first_row + count
+            if rows < count:
+                problems.append(f"rows {first_row}-{first_row + count - 1}: {count - rows} of them missing")
+            elif summary != summaries[first_row]:
+                problems.append(f"rows {first_row}-{first_row + count - 1}: summary mismatch")
+        # rows inserted after the load sit past the last loaded rowid
+        extra = conn.execute(f"SELECT COUNT(*) FROM {table_name} WHERE rowid > ? OR rowid < 1", (end,)).fetchone()[0]
+    if extra:
+        problems.append(f"{extra} rows beyond the {row_count} loaded")
+    if not problems and table_checksum(columns, digests) != expected:
+        problems.append("table checksum mismatch; the chunk checksums were changed")
+    return scanned + extra, problems
+
+
+def verify_ingest(conn, tables=None, deep=False):
+    """ verify the ingested tables against the checksums recorded while they were written
+
+    Args:
+        conn (sqlite3.Connection): database connection
+        tables (list, optional): tables to check. Defaults to the train, test and ideal tables.
+        deep (bool, optional): compare the sha256 of every chunk, see verify_table(). Defaults to False.
+
+    Returns:
+        dict: table name -> list of problems, empty for a table that passed
+    """
+    results = {}
+    for table_name in tables or [table_name for table_name, _ in DATASETS]:
+        start = time.perf_counter()
+        rows, problems = verify_table(conn, table_name, deep)
+        elapsed = time.perf_counter() - start
+        status = "OK" if not problems else "FAILED"
+        print(f"{table_name}: {rows} rows {status} in {elapsed:.2f}s ({rows / max(elapsed, 1e-9):.0f} rows/s)")
+        for problem in problems:
+            print(f"    {problem}")
+        results[table_name] = problems
+    return results
+
+
+def dump_unit_test(conn):
+    """ unit test: every row of the loaded tables matches the checksums recorded by ingest
+    """
+    print("===============performing unit test================")
+    results = verify_ingest(conn)
+    if any(results.values()):
+        print("unit test failed. Program exit.")
+        sys.exit(1)
+    print("unit test passed!")
     print("===================================================")
-    
-dump_unit_test()
 
+def main():
+    parser = argparse.ArgumentParser(description="dump train/test/ideal csv files into functions.db")
+    parser.add_argument("--dataset-dir", default=DATASET_DIR, help="directory holding the csv files and functions.db")
+    parser.add_argument("--stream", action="store_true", help="read the csv files in chunks and insert them in explicit transactions")
+    parser.add_argument("--chunksize", type=int, default=100000, help="rows per chunk/transaction in streaming mode")
+    parser.add_argument("--restart", action="store_true", help="ignore an interrupted streaming load and start over")
+    parser.add_argument("--verify", action="store_true", help="only verify functions.db against the ingest checksums")
+    parser.add_argument("--deep", action="store_true", help="with --verify, compare the sha256 of every chunk instead of the SQLite summaries")
+    args = parser.parse_args()
+    if args.verify:
+        conn = sqlite3.connect(os.path.join(args.dataset_dir, "functions.db"))
+        results = verify_ingest(conn, deep=args.deep)
+        conn.close()
+        sys.exit(1 if any(results.values()) else 0)
+    ingest(args.dataset_dir, args.stream, args.chunksize, args.restart, unit_test=True)
 
-conn.close()
\ No newline at end of file
+if __name__ == "__main__":
+    main()
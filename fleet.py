@@ -0,0 +1,204 @@
+import contextlib
+import json
+import multiprocessing as mp
+import os
+import queue
+import sqlite3
+import time
+import traceback
+from collections import deque
+
+FLEET_STAGES = ["ingest", "train", "match"]
+# BLAS/OpenMP pools sized to the machine in every worker would oversubscribe the cores
+THREAD_VARIABLES = ["OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS", "NUMEXPR_NUM_THREADS", "VECLIB_MAXIMUM_THREADS"]
+# imported once by the fork server, so each dataset process starts without paying for pandas/numpy.
+# Only third-party modules: the server imports them before the children get the parent's sys.path,
+# so a repo module such as test would resolve against the working directory, or the stdlib test
+# package when started outside the repo, and stay cached for every dataset
+PRELOAD = ["numpy", "pandas"]
+
+
+def read_manifest(path):
+    """ dataset directories listed in a manifest file, one per line
+
+    Blank lines and lines starting with # are skipped; relative paths are resolved against the
+    directory of the manifest.
+
+    Args:
+        path (str): manifest file
+
+    Returns:
+        list: absolute dataset directories, in manifest order
+    """
+    base = os.path.dirname(os.path.abspath(path))
+    dataset_dirs = []
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if line and not line.startswith("#"):
+                dataset_dirs.append(os.path.normpath(os.path.join(base, os.path.expanduser(line))))
+    return dataset_dirs
+
+
+def run_dataset(dataset_dir, stage_args=None, force=False):
+    """ ingest, train and match one dataset through the same stage functions and fingerprints as cli.py
+
+    Args:
+        dataset_dir (str): directory holding train.csv, test.csv, ideal.csv and functions.db
+        stage_args (dict, optional): stage -> extra cli arguments, e.g. {"train": ["--compact", "float32"]}. Defaults to None.
+        force (bool, optional): rerun stages whose inputs did not change. Defaults to False.
+
+    Returns:
+        dict: stage -> seconds (None when skipped as unchanged), matched and unmatched test points
+    """
+    import cli
+    stage_args = stage_args or {}
+    db_path = os.path.join(dataset_dir, "functions.db")
+    location = {"ingest": ["--dataset-dir", dataset_dir], "train": ["--db", db_path], "match": ["--db", db_path]}
+    parser = cli.build_parser()
+
+    result = {"stages": {}}
+    for stage in FLEET_STAGES:
+        args = parser.parse_args([stage, *location[stage], *stage_args.get(stage, []), *(["--force"] if force else [])])
+        start = time.perf_counter()
+        ran = args.func(args)
+        result["stages"][stage] = time.perf_counter() - start if ran else None
+
+    conn = sqlite3.connect(db_path)
+    result["matched"] = conn.execute("SELECT COUNT(*) FROM test_mapping").fetchone()[0]
+    result["unmatched"] = conn.execute("SELECT COUNT(*) FROM test_data").fetchone()[0] - result["matched"]
+    conn.close()
+    return result
+
+
+def fleet_worker(index, dataset_dir, stage_args, force, log_name, results):
+    """ process entry point: run_dataset() with its output in dataset_dir/log_name; the outcome,
+    including any exception, is put on the results queue as (index, result)
+    """
+    start = time.perf_counter()
+    try:
+        if not os.path.isdir(dataset_dir):
+            raise FileNotFoundError(f"no dataset directory {dataset_dir}")
+        with open(os.path.join(dataset_dir, log_name), "w") as log, contextlib.redirect_stdout(log), contextlib.redirect_stderr(log):
+            result = run_dataset(dataset_dir, stage_args, force)
+        result["status"] = "ok"
+    except BaseException as e:
+        result = {"status": "failed", "error": f"{type(e).__name__}: {e}", "traceback": traceback.format_exc()}
+    result["seconds"] = time.perf_counter() - start
+    results.put((index, result))
+
+
+def run_fleet(dataset_dirs, workers=None, timeout=None, stage_args=None, force=False, threads=1, log_name="fleet.log"):
+    """ run the pipeline on every dataset, up to workers datasets at a time
+
+    Every dataset runs in its own process, forked from a server that has numpy and pandas
+    imported already, so one dataset can fail, crash or be killed at its timeout without
+    affecting the others. Stage output goes to dataset_dir/log_name.
+
+    Args:
+        dataset_dirs (list): dataset directories
+        workers (int, optional): concurrent datasets. Defaults to os.cpu_count().
+        timeout (float, optional): seconds before a dataset is killed. Defaults to None (no limit).
+        stage_args (dict, optional): extra cli arguments per stage, see run_dataset(). Defaults to None.
+        force (bool, optional): rerun unchanged stages. Defaults to False.
+        threads (int, optional): BLAS/OpenMP threads per dataset. Defaults to 1.
+        log_name (str, optional): log file written in each dataset directory. Defaults to "fleet.log".
+
+    Returns:
+        list: one result dict per dataset, in input order, with dataset, status ("ok", "failed",
+        "timeout" or "crashed"), seconds, and stages/matched/unmatched or error
+    """
+    workers = workers or os.cpu_count()
+    for variable in THREAD_VARIABLES:
+        os.environ[variable] = str(threads)
+    if "forkserver" in mp.get_all_start_methods():
+        ctx = mp.get_context("forkserver")
+        ctx.set_forkserver_preload(PRELOAD)
+    else:
+        ctx = mp.get_context("spawn")
+
+    print(f"================fleet: {len(dataset_dirs)} datasets, {workers} workers=================")
+    start = time.perf_counter()
+    results_queue = ctx.Queue()
+    pending = deque(enumerate(dataset_dirs))
+    running = {}
+    results = [None] * len(dataset_dirs)
+
+    def finish(index, result):
+        result["dataset"] = dataset_dirs[index]
+        results[index] = result
+        done = sum(r is not None for r in results)
+        print(f"[{done}/{len(dataset_dirs)}] {result['status']:>7} {result['seconds']:8.2f}s  {dataset_dirs[index]}")
+
+    while pending or running:
+        while pending and len(running) < workers:
+            index, dataset_dir = pending.popleft()
+            process = ctx.Process(target=fleet_worker, args=(index, dataset_dir, stage_args, force, log_name, results_queue), daemon=True)
+            process.start()
+            running[index] = (process, time.perf_counter())
+
+        with contextlib.suppress(queue.Empty):
+            index, result = results_queue.get(timeout=0.05)
+            finish(index, result)
+
+        now = time.perf_counter()
+        for index, (process, started) in list(running.items()):
+            if results[index] is not None:
+                process.join()
+                del running[index]
+            elif not process.is_alive():
+                # the result may still be in flight from a process that exited normally
+                with contextlib.suppress(queue.Empty):
+                    other, result = results_queue.get(timeout=0.5)
+                    finish(other, result)
+                    if other != index:
+                        continue
+                if results[index] is None:
+                    finish(index, {"status": "crashed", "error": f"exit code {process.exitcode}", "seconds": now - started})
+                del running[index]
+            elif timeout is not None and now - started > timeout:
+                process.kill()
+                process.join()
+                finish(index, {"status": "timeout", "error": f"killed after {timeout:g}s", "seconds": now - started})
+                del running[index]
+
+    elapsed = time.perf_counter() - start
+    print_summary(results, elapsed)
+    return results
+
+
+def print_summary(results, elapsed=None):
+    """ one row per dataset with its status, per-stage seconds ("cached" when skipped as unchanged)
+    and matched/unmatched points, then the totals
+    """
+    name_width = max([len(os.path.basename(r["dataset"].rstrip(os.sep)) or r["dataset"]) for r in results] + [7])
+    print(f"{'dataset':<{name_width}} {'status':>7} " + " ".join(f"{stage:>8}" for stage in FLEET_STAGES)
+          + f" {'total':>8} {'matched':>8} {'unmatch':>8}  error")
+    for r in results:
+        name = os.path.basename(r["dataset"].rstrip(os.sep)) or r["dataset"]
+        stages = r.get("stages", {})
+        cells = [("cached" if stages[stage] is None else f"{stages[stage]:.2f}") if stage in stages else "-" for stage in FLEET_STAGES]
+        print(f"{name:<{name_width}} {r['status']:>7} " + " ".join(f"{cell:>8}" for cell in cells)
+              + f" {r['seconds']:8.2f} {r.get('matched', '-'):>8} {r.get('unmatched', '-'):>8}  {r.get('error', '')}")
+
+    statuses = [r["status"] for r in results]
+    busy = sum(r["seconds"] for r in results)
+    line = ", ".join(f"{statuses.count(status)} {status}" for status in ("ok", "failed", "timeout", "crashed") if status in statuses)
+    if elapsed:
+        line += f"; {elapsed:.2f}s wall, {busy:.2f}s summed over datasets ({busy / elapsed:.1f}x)"
+    print(line)
+    print("======================================================")
+
+
+def save_summary(results, path):
+    """ write the fleet results as JSON, tracebacks included
+    """
+    with open(path, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Fleet summary saved as {path}")
+
+
+def exit_code(results):
+    """ 0 if every dataset succeeded, 1 otherwise
+    """
+    return 0 if all(r["status"] == "ok" for r in results) else 1
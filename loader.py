@@ -1,55 +1,669 @@
+import hashlib
+import itertools
+import json
+import os
+import pathlib
 import sqlite3
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
 import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
+from metrics import metrics
+
+# PIPELINE_DB overrides the default database for every entry point that doesn't get an explicit path
+DEFAULT_DB_PATH = os.environ.get("PIPELINE_DB", "/Users/lincong/Desktop/python_course/assignment/Dataset/functions.db")
+# PIPELINE_STORE points the entry points at a column store converted from that database (dump_columnar.py)
+DEFAULT_STORE_DIR = os.environ.get("PIPELINE_STORE") or None
+
+# bound parameters per query; SQLite builds before 3.32 cap this at 999
+MAX_QUERY_PARAMS = 900
+# columns per lazy fetch query; SQLite's default SQLITE_MAX_COLUMN is 2000
+MAX_QUERY_COLUMNS = 500
+# columns per query while filling a compact array, bounding the float64 frame that passes through
+COMPACT_QUERY_COLUMNS = 64
+# cache identities of in-memory databases; id() of a closed connection gets reused, a count does not
+MEMORY_LOCATIONS = itertools.count()
+
+class DataLoadingError(Exception):
+    """raised when a table can't be loaded from the database
+    """
+
+class SQLiteStorage():
+    """default storage backend: reads tables through SQL on the connector's sqlite3 connection
+    """
+    def __init__(self, conn):
+        """_summary_
+        Args:
+            conn (sqlite3.Connection): open database connection
+        """
+        self.conn = conn
+        self.db_file = next((row[2] for row in conn.execute("PRAGMA database_list") if row[1] == "main"), "")
+        self.memory_location = None if self.db_file else f"memory:{next(MEMORY_LOCATIONS)}"
+
+    def location(self):
+        """ cache identity of this database: its file path, or a token unique to this storage for
+        in-memory databases, whose total_changes version restarts at 0 on every new connection
+        """
+        return os.path.abspath(self.db_file) if self.db_file else self.memory_location
+
+    def version(self):
+        """ cheap change token: the header's file change counter plus mtime/size of the db and its WAL.
+        Any committed write from any connection or process changes at least one of them.
+        """
+        if not self.db_file:
+            return self.conn.total_changes
+        token = []
+        for path in (self.db_file, self.db_file + "-wal"):
+            try:
+                st = os.stat(path)
+                token += [st.st_mtime_ns, st.st_size]
+            except FileNotFoundError:
+                token += [None, None]
+        with open(self.db_file, "rb") as f:
+            token.append(f.read(28)[24:28])
+        return tuple(token)
+
+    def table_columns(self, table_name):
+        """ column names of table_name, in table order
+        """
+        return [row[1] for row in self.conn.execute(f"PRAGMA table_info({table_name})")]
+
+    def query(self, table_name, columns, x_range=None, x_values=None):
+        """ select rowid and columns, restricted to x_range/x_values through the index on x when given
+
+        Args:
+            table_name (str): table to read
+            columns (list): column names to select
+            x_range (tuple, optional): (low, high) bounds on x. Defaults to None.
+            x_values (array-like, optional): x values to select. Defaults to None.
+
+        Returns:
+            pd.DataFrame: _rowid plus the requested columns, in table order, or by x when filtered
+        """
+        select = ", ".join(["rowid AS _rowid"] + [f'"{c}"' for c in columns])
+        query = f"SELECT {select} FROM {table_name}"
+        if x_range is None and x_values is None:
+            return pd.read_sql(query + " ORDER BY rowid", self.conn)
+
+        conditions = []
+        params = []
+        if x_range is not None:
+            conditions.append("x BETWEEN ? AND ?")
+            params += [float(x_range[0]), float(x_range[1])]
+
+        if x_values is None:
+            return pd.read_sql(query + " WHERE " + " AND ".join(conditions) + " ORDER BY x, rowid", self.conn, params=params)
+
+        # IN lists are chunked to stay below SQLite's bound-parameter limit
+        values = np.unique(np.asarray(x_values, dtype=np.float64))
+        frames = []
+        for start in range(0, len(values), MAX_QUERY_PARAMS):
+            chunk = values[start:start + MAX_QUERY_PARAMS].tolist()
+            in_clause = "x IN (" + ", ".join("?" * len(chunk)) + ")"
+            frames.append(pd.read_sql(query + " WHERE " + " AND ".join(conditions + [in_clause]), self.conn, params=params + chunk))
+
+        if not frames:
+            return pd.read_sql(query + " LIMIT 0", self.conn)
+        frame = pd.concat(frames, ignore_index=True)
+        order = ["x", "_rowid"] if "x" in frame.columns else ["_rowid"]
+        return frame.sort_values(order, kind="stable").reset_index(drop=True)
+
+class ColumnStore():
+    """storage backend over memory-mapped column arrays: one .npy file per column plus a
+    manifest.json, written by convert_to_columnar(). Opening a table maps the files instead
+    of parsing rows, and the OS page cache shares the pages between processes.
+    """
+    def __init__(self, store_dir):
+        """_summary_
+        Args:
+            store_dir (str): directory written by convert_to_columnar()
+        """
+        self.store_dir = store_dir
+        with open(os.path.join(store_dir, "manifest.json")) as f:
+            self.manifest = json.load(f)
+        self.arrays = {}
+
+    def location(self):
+        return os.path.abspath(self.store_dir)
+
+    def check_source(self, conn, db_path):
+        """ raise DataLoadingError unless the store was converted from db_path and, where both
+        recorded ingest checksums, from the tables it holds now
+
+        Args:
+            conn (sqlite3.Connection): connection to db_path
+            db_path (str): database the store is used with
+        """
+        if db_path != ":memory:" and os.path.realpath(self.manifest["source"]) != os.path.realpath(db_path):
+            raise DataLoadingError(f"column store {self.store_dir} was converted from {self.manifest['source']}, not {db_path}")
+        for table_name, checksum in self.manifest.get("checksums", {}).items():
+            current = source_checksum(conn, table_name)
+            if current is not None and current != checksum:
+                raise DataLoadingError(f"{table_name} was re-ingested after column store {self.store_dir} was written; "
+                                       "convert it again with dump_columnar.py")
+
+    def version(self):
+        """ the manifest is rewritten on every conversion, so its mtime is the change token
+        """
+        return os.stat(os.path.join(self.store_dir, "manifest.json")).st_mtime_ns
+
+    def has_table(self, table_name):
+        return table_name in self.manifest["tables"]
+
+    def table_columns(self, table_name):
+        """ column names of table_name, in table order
+        """
+        return list(self.manifest["tables"][table_name]["columns"])
+
+    def array(self, table_name, column):
+        """ memory-mapped array of one column, mapped on first use
+        """
+        key = (table_name, column)
+        if key not in self.arrays:
+            self.arrays[key] = np.load(os.path.join(self.store_dir, table_name, column + ".npy"), mmap_mode="r")
+        return self.arrays[key]
+
+    def query(self, table_name, columns, x_range=None, x_values=None):
+        """ same contract as SQLiteStorage.query(), answered from the mapped arrays
+
+        Returns:
+            pd.DataFrame: _rowid plus the requested columns, in table order, or by x when filtered
+        """
+        rowids = self.array(table_name, "_rowid")
+        if x_range is None and x_values is None:
+            data = {"_rowid": rowids}
+            data.update({c: self.array(table_name, c) for c in columns})
+            return pd.DataFrame(data, copy=False)
+
+        x = self.array(table_name, "x")
+        mask = np.ones(len(x), dtype=bool)
+        if x_range is not None:
+            mask &= (x >= x_range[0]) & (x <= x_range[1])
+        if x_values is not None:
+            mask &= np.isin(x, np.asarray(x_values, dtype=np.float64))
+        idx = np.flatnonzero(mask)
+        idx = idx[np.lexsort((rowids[idx], x[idx]))]
+
+        data = {"_rowid": rowids[idx]}
+        data.update({c: self.array(table_name, c)[idx] for c in columns})
+        return pd.DataFrame(data)
 
 class DBConnector():
     """class for DB connection
+
+    Owns one primary connection (conn/cursor, used by the loaders and for writes) and a small
+    pool of read-only connections for concurrent readers, see reader(). Every connection gets
+    the same PRAGMA settings. Use it as a context manager, or call close(); nothing else closes
+    the connections.
     """
-    def __init__(self, db_path="/Users/lincong/Desktop/python_course/assignment/Dataset/functions.db"):
+    def __init__(self, db_path=DEFAULT_DB_PATH, storage=None, read_only=False, pool_size=4, timeout=30,
+                 journal_mode=None, synchronous=None, cache_size=-65536, mmap_size=256 << 20, temp_store="MEMORY", store_dir=None):
         """_summary_
         Args:
-            db_path (str, optional): location of db file. Defaults to "/Users/lincong/Desktop/python_course/assignment/Dataset/functions.db".
+            db_path (str, optional): location of db file. Defaults to DEFAULT_DB_PATH ($PIPELINE_DB if set).
+            storage (optional): backend the loaders read tables from, e.g. ColumnStore(dir). Defaults to SQLiteStorage on this connection.
+            read_only (bool, optional): open the primary connection read-only too (mode=ro URI). Defaults to False.
+            pool_size (int, optional): idle read-only connections kept for reuse. Defaults to 4.
+            timeout (float, optional): seconds to wait for a lock before failing. Defaults to 30.
+            journal_mode (str, optional): e.g. "WAL", so readers don't block the writer and vice versa. It is
+                persistent and only set on writable connections. Defaults to None (unchanged).
+            synchronous (str, optional): e.g. "NORMAL" or "FULL". Defaults to None (SQLite default).
+            cache_size (int, optional): page cache, in pages or, if negative, KiB. Defaults to -65536 (64 MiB).
+            mmap_size (int, optional): bytes of the file read through mmap. Defaults to 256 MiB.
+            temp_store (str, optional): where temp tables and sort files live. Defaults to "MEMORY".
+            store_dir (str, optional): read the tables from this ColumnStore directory, checked against
+                db_path with ColumnStore.check_source(). Ignored when storage is given. Defaults to None.
         """
-        self.conn = sqlite3.connect(db_path)
+        self.db_path = db_path
+        self.read_only = read_only
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.pragmas = {"journal_mode": journal_mode, "synchronous": synchronous, "cache_size": cache_size,
+                        "mmap_size": mmap_size, "temp_store": temp_store}
+        self.pool = []
+        self.pool_lock = threading.Lock()
+        self.closed = False
+
+        self.conn = self.connect(read_only=read_only)
         self.cursor = self.conn.cursor()
+        self.sql_storage = SQLiteStorage(self.conn)
+        if storage is None and store_dir:
+            storage = ColumnStore(store_dir)
+            storage.check_source(self.conn, db_path)
+        self.storage = storage if storage is not None else self.sql_storage
+
+    def storage_for(self, table_name):
+        """ backend the loaders read table_name from: the configured storage, or SQL for tables
+        a column store doesn't hold (test_mapping, best_function_mapping, ...)
+        """
+        if isinstance(self.storage, ColumnStore) and not self.storage.has_table(table_name):
+            return self.sql_storage
+        return self.storage
+
+    def connect(self, read_only=False, check_same_thread=True):
+        """ open a new connection with this connector's settings; the caller closes it
+
+        Args:
+            read_only (bool, optional): open with mode=ro, writes raise sqlite3.OperationalError. Defaults to False.
+            check_same_thread (bool, optional): passed to sqlite3.connect. Defaults to True.
+        """
+        if read_only and self.db_path != ":memory:":
+            uri = pathlib.Path(self.db_path).resolve().as_uri() + "?mode=ro"
+            conn = sqlite3.connect(uri, uri=True, timeout=self.timeout, check_same_thread=check_same_thread)
+        else:
+            conn = sqlite3.connect(self.db_path, timeout=self.timeout, check_same_thread=check_same_thread)
+        for name, value in self.pragmas.items():
+            if value is None or (name == "journal_mode" and read_only):
+                continue
+            conn.execute(f"PRAGMA {name} = {value}").fetchall()
+        return conn
+
+    def acquire(self):
+        """ take an idle read-only connection from the pool, or open one
+        """
+        if self.closed:
+            raise sqlite3.ProgrammingError("DBConnector is closed")
+        with self.pool_lock:
+            if self.pool:
+                return self.pool.pop()
+        # pooled connections move between threads, one user at a time
+        return self.connect(read_only=True, check_same_thread=False)
+
+    def release(self, conn):
+        """ give a connection from acquire() back; closed if the pool is full or the connector closed
+        """
+        with self.pool_lock:
+            if not self.closed and len(self.pool) < self.pool_size:
+                conn.rollback()
+                self.pool.append(conn)
+                return
+        conn.close()
+
+    @contextmanager
+    def reader(self):
+        """ borrow a pooled read-only connection for the duration of a with block
+
+        An in-memory database can't be shared between connections, so its readers get conn.
+        """
+        if self.db_path == ":memory:":
+            yield self.conn
+            return
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    def close(self):
+        """ close the primary and all pooled connections; safe to call twice
+        """
+        with self.pool_lock:
+            self.closed = True
+            pool, self.pool = self.pool, []
+        for conn in pool:
+            conn.close()
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+def source_checksum(conn, table_name):
+    """ table checksum recorded by ingest, None for databases loaded without checksums
+    """
+    try:
+        row = conn.execute("SELECT checksum FROM table_checksums WHERE table_name = ?", (table_name,)).fetchone()
+    except sqlite3.OperationalError:
+        return None
+    return row[0] if row else None
+
+def convert_to_columnar(db_path, store_dir, tables=("train_data", "test_data", "ideal_functions"), chunksize=100000):
+    """ convert tables of an existing functions.db into a ColumnStore directory.
+    Rows are streamed in rowid order into preallocated .npy files, so memory stays bounded.
+
+    Args:
+        db_path (str): source SQLite database
+        store_dir (str): destination directory
+        tables (tuple, optional): numeric tables to convert. Defaults to the three dataset tables.
+        chunksize (int, optional): rows per fetch. Defaults to 100000.
+    """
+    conn = sqlite3.connect(db_path)
+    manifest = {"source": os.path.abspath(db_path), "tables": {}, "checksums": {}}
+    for table_name in tables:
+        columns = SQLiteStorage(conn).table_columns(table_name)
+        num_rows = conn.execute(f"SELECT COUNT(*) FROM {table_name}").fetchone()[0]
+        os.makedirs(os.path.join(store_dir, table_name), exist_ok=True)
+
+        arrays = [np.lib.format.open_memmap(os.path.join(store_dir, table_name, c + ".npy"), mode="w+",
+                                            dtype=np.int64 if c == "_rowid" else np.float64, shape=(num_rows,))
+                  for c in ["_rowid"] + columns]
+        cursor = conn.execute(f"SELECT rowid, * FROM {table_name} ORDER BY rowid")
+        pos = 0
+        while True:
+            rows = cursor.fetchmany(chunksize)
+            if not rows:
+                break
+            block = np.array(rows, dtype=np.float64)
+            for i, array in enumerate(arrays):
+                array[pos:pos + len(rows)] = block[:, i]
+            pos += len(rows)
+
+        for array in arrays:
+            array.flush()
+        manifest["tables"][table_name] = {"columns": columns, "rows": num_rows}
+        checksum = source_checksum(conn, table_name)
+        if checksum is not None:
+            manifest["checksums"][table_name] = checksum
+
+    conn.close()
+    # the manifest is written last, so a store is only visible once every column is complete
+    tmp_path = os.path.join(store_dir, "manifest.json.tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, os.path.join(store_dir, "manifest.json"))
+
+class TableCache():
+    """process-local LRU cache of loaded tables, shared by every Dataloader in the process.
+    Entries are keyed by (storage location, table, columns, row filter) and tagged with the
+    storage's change token, so a table that changed on disk is reloaded instead of served stale.
+    """
+    def __init__(self, max_bytes=512 * 1024 ** 2):
+        """_summary_
+        Args:
+            max_bytes (int, optional): memory cap; least recently used entries are evicted beyond it. Defaults to 512 MiB.
+        """
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_load(self, storage, table_name, columns, x_range=None, x_values=None):
+        """ return the cached frame for this query, loading it from storage on a miss or when stale
+
+        Returns:
+            pd.DataFrame: same contract as storage.query(); callers must not modify it in place
+        """
+        if x_values is not None:
+            x_values = np.unique(np.asarray(x_values, dtype=np.float64))
+            row_filter = hashlib.sha1(x_values.tobytes()).hexdigest()
+        else:
+            row_filter = None
+        location = storage.location()
+        key = (location, table_name, tuple(columns), tuple(x_range) if x_range is not None else None, row_filter)
+        version = storage.version()
+
+        entry = self.entries.get(key)
+        if entry is not None and entry[0] == version:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+        self.misses += 1
+        # a new version makes every entry of this location stale, not only this key
+        for stale_key in [k for k, e in self.entries.items() if k[0] == location and e[0] != version]:
+            self.pop(stale_key)
+
+        frame = storage.query(table_name, columns, x_range, x_values)
+        size = int(frame.memory_usage(index=True, deep=False).sum())
+        if size <= self.max_bytes:
+            self.entries[key] = (version, frame, size)
+            self.total_bytes += size
+            while self.total_bytes > self.max_bytes:
+                self.pop(next(iter(self.entries)))
+        return frame
+
+    def pop(self, key):
+        """ drop one entry
+        """
+        _, _, size = self.entries.pop(key)
+        self.total_bytes -= size
+
+    def clear(self):
+        """ drop every entry
+        """
+        self.entries.clear()
+        self.total_bytes = 0
+
+# default cache used by every Dataloader unless one is passed explicitly
+table_cache = TableCache()
 
 class Dataloader():
     """Parent class for dataloders. visualization fuction embedded
+
+    With a dtype the loader runs in compact mode: the non-x columns live in one contiguous 2-D
+    array (values, with column_index mapping names to its columns) of that dtype, and x is kept
+    as a float64 vector because it is matched by equality. array() hands out views of it; df,
+    get_columns() and column() still work but build pandas objects on demand.
     """
-    def __init__(self, db_connector, table_name):
+    def __init__(self, db_connector, table_name, x_range=None, x_values=None, columns=None, lazy=False, cache=table_cache, dtype=None):
         """_summary_
 
         Args:
             db_connector (_type_): instance of  DBConnector() as argument
             table_name (_type_): train_data/test_data/ideal_functions
+            x_range (tuple, optional): (low, high), only load rows with low <= x <= high. Defaults to None.
+            x_values (array-like, optional): only load rows whose x is in x_values. Defaults to None.
+            columns (list, optional): projection, the only columns this loader may load. x is always included. Defaults to every column.
+            lazy (bool, optional): load only x up front and fetch other columns on first access. Defaults to False.
+            cache (TableCache, optional): cache shared with other loaders, None to always read from storage. Defaults to table_cache.
+            dtype (optional): np.float32 or np.float64 for compact mode; compact loaders bypass the cache, whose
+                float64 frames would defeat the point. Defaults to None (pandas DataFrame).
         """
         self.db = db_connector
+        self.cache = cache
         self.table_name = table_name
-        self.df = pd.read_sql("SELECT * FROM " + self.table_name, self.db.conn)
+        self.x_range = x_range
+        self.x_values = x_values
+        self.lazy = lazy
+        self.storage = self.db.storage_for(table_name)
+        self.table_columns = self.storage.table_columns(self.table_name)
+        if columns is None:
+            self.columns = list(self.table_columns)
+        else:
+            unknown = [c for c in columns if c not in self.table_columns]
+            if unknown:
+                raise KeyError(f"columns {unknown} not in table {self.table_name}")
+            self.columns = [c for c in self.table_columns if c == "x" or c in columns]
+
+        self.dtype = np.dtype(dtype) if dtype is not None else None
+        if self.dtype is not None:
+            self.cache = None
+
+        frame = self.query(["x"] if lazy or self.dtype is not None else self.columns)
+        self._rowids = frame["_rowid"].to_numpy()
+        if self.dtype is None:
+            self._df = frame.drop(columns="_rowid")
+            return
+
+        self._df = None
+        self.x = frame["x"].to_numpy(dtype=np.float64)
+        self.values = np.empty((len(self.x), 0), dtype=self.dtype)
+        self.column_index = {}
+        if not lazy:
+            self.fetch_columns(self.columns)
+
+    @property
+    def df(self):
+        """ the loaded table with every projected column; in lazy mode this fetches all missing columns
+        """
+        self.fetch_columns(self.columns)
+        if self.dtype is not None:
+            return self.frame(self.columns)
+        return self._df
+
+    def frame(self, columns):
+        """ compact mode: a DataFrame copy of the given loaded columns
+        """
+        return pd.DataFrame({c: self.x if c == "x" else self.values[:, self.column_index[c]] for c in columns}, columns=columns)
+
+    def array(self, columns):
+        """ return the given columns as one 2-D array, fetching the ones not loaded yet
+
+        In compact mode this is a view of values when the columns are adjacent in it (e.g. every
+        non-x column, in table order) and a copy otherwise; it has the loader's dtype unless x
+        is requested. Otherwise it is a float64 copy of the frame's columns.
+
+        Args:
+            columns (list): column names, must be part of the projection
+
+        Returns:
+            np.ndarray: (rows, len(columns)) array
+        """
+        columns = list(columns)
+        self.fetch_columns(columns)
+        if self.dtype is None:
+            return self._df[columns].to_numpy(dtype=np.float64)
+        if "x" in columns:
+            return np.column_stack([self.x if c == "x" else self.values[:, self.column_index[c]] for c in columns])
+        idx = [self.column_index[c] for c in columns]
+        if idx and idx == list(range(idx[0], idx[0] + len(idx))):
+            return self.values[:, idx[0]:idx[0] + len(idx)]
+        return self.values[:, idx]
+
+    def loaded(self, name):
+        if self.dtype is None:
+            return name in self._df.columns
+        return name == "x" or name in self.column_index
+
+    def get_columns(self, columns):
+        """ return the given columns, fetching the ones not loaded yet
+
+        Args:
+            columns (list): column names, must be part of the projection
+
+        Returns:
+            pd.DataFrame: the requested columns
+        """
+        columns = list(columns)
+        self.fetch_columns(columns)
+        if self.dtype is not None:
+            return self.frame(columns)
+        return self._df[columns]
+
+    def column(self, name):
+        """ return a single column, fetching it on first access
+
+        Args:
+            name (str): column name, must be part of the projection
+
+        Returns:
+            pd.Series: the requested column
+        """
+        self.fetch_columns([name])
+        if self.dtype is not None:
+            return pd.Series(self.x if name == "x" else self.values[:, self.column_index[name]], name=name)
+        return self._df[name]
+
+    def fetch_columns(self, columns):
+        """ load missing columns from SQLite and cache them, aligned on rowid with the rows already loaded
+
+        Args:
+            columns (list): column names, must be part of the projection
+        """
+        missing = [c for c in dict.fromkeys(columns) if not self.loaded(c)]
+        if not missing:
+            return
+        unknown = [c for c in missing if c not in self.columns]
+        if unknown:
+            raise KeyError(f"columns {unknown} not loaded by this {self.table_name} loader")
+        if self.dtype is not None:
+            self.fetch_compact(missing)
+            return
+
+        frames = [self._df]
+        for start in range(0, len(missing), MAX_QUERY_COLUMNS):
+            fetched = self.query(missing[start:start + MAX_QUERY_COLUMNS]).set_index("_rowid").reindex(self._rowids)
+            fetched.index = self._df.index
+            frames.append(fetched)
+
+        loaded = pd.concat(frames, axis=1)
+        self._df = loaded[[c for c in self.columns if c in loaded.columns]]
+
+    def fetch_compact(self, missing):
+        """ compact mode: append columns to values, reallocating it once per call so it stays contiguous
+
+        Args:
+            missing (list): projected non-x columns not loaded yet
+        """
+        offset = self.values.shape[1]
+        values = np.empty((len(self._rowids), offset + len(missing)), dtype=self.dtype)
+        values[:, :offset] = self.values
+        for start in range(0, len(missing), COMPACT_QUERY_COLUMNS):
+            batch = missing[start:start + COMPACT_QUERY_COLUMNS]
+            fetched = self.query(batch).set_index("_rowid").reindex(self._rowids)
+            values[:, offset + start:offset + start + len(batch)] = fetched[batch].to_numpy()
+        self.values = values
+        self.column_index.update({c: offset + i for i, c in enumerate(missing)})
+
+    def query(self, columns):
+        """ read rowid and columns of this loader's rows from the cache or the connector's storage backend
+
+        Args:
+            columns (list): column names to select
+
+        Returns:
+            pd.DataFrame: _rowid plus the requested columns
+        """
+        with metrics.stage("loader.query", table=self.table_name, columns=len(columns)) as record:
+            if self.cache is None:
+                frame = self.storage.query(self.table_name, columns, self.x_range, self.x_values)
+            else:
+                hits = self.cache.hits
+                frame = self.cache.get_or_load(self.storage, self.table_name, columns, self.x_range, self.x_values)
+                record["cache_hit"] = self.cache.hits > hits
+            record["rows"] = len(frame)
+        metrics.count("loader.queries")
+        return frame
     
-    def viz_df(self):
+    def viz_df(self, output=None, density=None, bins=512):
         """ generate plt.scatter for train_data/test_data/ideal_functions
+
+        Args:
+            output (str, optional): PNG path; the figure is rendered headless and not shown. Defaults to None.
+            density (bool, optional): draw a 2D histogram raster instead of markers. Defaults to None
+                (only above plotting.DENSITY_THRESHOLD points).
+            bins (int, optional): raster bins per axis in density mode. Defaults to 512.
         """
-        num_col = len(self.df.iloc[0])
-        
-        x = self.df["x"].values
-        num_row = len(x)
-        x = np.repeat(x, num_col-1)
-        y = []
-
-        for i in range(num_row):
-            y = y + self.df.iloc[i, 1:].values.tolist()
-        
-        plt.figure(figsize=(8, 6))
-        plt.scatter(x, y, c="gray", s=1, label=self.table_name, alpha=0.7)
+        # matplotlib is only imported when a plot is actually requested
+        from plotting import pyplot, draw_points, finish, use_density
+        plt = pyplot(headless=output is not None)
+
+        # row-major ravel gives the same point order as walking the rows
+        y_columns = [c for c in self.columns if c != "x"]
+        y = self.array(y_columns).ravel()
+        x = np.repeat(self.column("x").to_numpy(dtype=np.float64), len(y_columns))
+
+        fig, ax = plt.subplots(figsize=(8, 6))
+        draw_points(ax, x, y, use_density(len(y), density), bins, color="gray", s=1, label=self.table_name, alpha=0.7)
         # plt.yticks(np.arange(-40, 40, 5))
-        plt.xlabel("X")
-        plt.ylabel("Y")
-        plt.legend()
-        plt.title("Visualization of data: " + self.table_name)
-        plt.show()
+        ax.set_xlabel("X")
+        ax.set_ylabel("Y")
+        ax.legend()
+        ax.set_title("Visualization of data: " + self.table_name)
+        finish(plt, fig, output, name=self.table_name)
+
+
+def column_max_deviation(train_loader, function_loader, train_column, ideal_column):
+    """ largest |train - ideal| between one training column and one ideal column, row by row
 
+    float64 differences of the raw columns without pandas temporaries; nanmax skips missing values
+    like Series.max() did.
+
+    Args:
+        train_loader (Dataloader): loader holding train_column
+        function_loader (Dataloader): loader holding ideal_column, aligned row by row with train_loader
+        train_column (str): training column
+        ideal_column (str): ideal column
+
+    Returns:
+        float: maximum absolute deviation
+    """
+    deviation = np.abs(train_loader.array([train_column])[:, 0].astype(np.float64) - function_loader.array([ideal_column])[:, 0])
+    return float(np.nanmax(deviation))
 
 
 class FunctionDataloader(Dataloader):
@@ -58,14 +672,20 @@ class FunctionDataloader(Dataloader):
     Args:
         Dataloader (_type_): _description_
     """
-    def __init__(self, db_connector, table_name="ideal_functions"):
+    def __init__(self, db_connector, table_name="ideal_functions", x_range=None, x_values=None, columns=None, lazy=False, cache=table_cache, dtype=None):
         """calling parent class Dataloader's constructor to initialize attributes
 
         Args:
             db_connector (_type_): _description_
             table_name (str, optional): _description_. Defaults to "ideal_functions".
+            x_range (tuple, optional): see Dataloader. Defaults to None.
+            x_values (array-like, optional): see Dataloader. Defaults to None.
+            columns (list, optional): see Dataloader. Defaults to None.
+            lazy (bool, optional): see Dataloader. Defaults to False.
+            cache (TableCache, optional): see Dataloader. Defaults to table_cache.
+            dtype (optional): see Dataloader. Defaults to None.
         """
-        super().__init__(db_connector, table_name)
+        super().__init__(db_connector, table_name, x_range, x_values, columns, lazy, cache, dtype)
 
 class TrainDataloader(Dataloader):
     """child class of Dataloader. for loading train_data
@@ -73,14 +693,20 @@ class TrainDataloader(Dataloader):
     Args:
         Dataloader (_type_): _description_
     """
-    def __init__(self, db_connector, table_name="train_data"):
+    def __init__(self, db_connector, table_name="train_data", x_range=None, x_values=None, columns=None, lazy=False, cache=table_cache, dtype=None):
         """calling parent class Dataloader's constructor to initialize attributes
 
         Args:
             db_connector (_type_): _description_
             table_name (str, optional): _description_. Defaults to "train_data".
+            x_range (tuple, optional): see Dataloader. Defaults to None.
+            x_values (array-like, optional): see Dataloader. Defaults to None.
+            columns (list, optional): see Dataloader. Defaults to None.
+            lazy (bool, optional): see Dataloader. Defaults to False.
+            cache (TableCache, optional): see Dataloader. Defaults to table_cache.
+            dtype (optional): see Dataloader. Defaults to None.
         """
-        super().__init__(db_connector, table_name)
+        super().__init__(db_connector, table_name, x_range, x_values, columns, lazy, cache, dtype)
 
 class TestDataloader(Dataloader):
     """child class of Dataloader. for loading test_data
@@ -88,11 +714,17 @@ class TestDataloader(Dataloader):
     Args:
         Dataloader (_type_): _description_
     """
-    def __init__(self, db_connector, table_name="test_data"):
+    def __init__(self, db_connector, table_name="test_data", x_range=None, x_values=None, columns=None, lazy=False, cache=table_cache, dtype=None):
         """calling parent class Dataloader's constructor to initialize attributes
 
         Args:
             db_connector (_type_): _description_
             table_name (str, optional): _description_. Defaults to "test_data".
+            x_range (tuple, optional): see Dataloader. Defaults to None.
+            x_values (array-like, optional): see Dataloader. Defaults to None.
+            columns (list, optional): see Dataloader. Defaults to None.
+            lazy (bool, optional): see Dataloader. Defaults to False.
+            cache (TableCache, optional): see Dataloader. Defaults to table_cache.
+            dtype (optional): see Dataloader. Defaults to None.
         """
-        super().__init__(db_connector, table_name)
\ No newline at end of file
+        super().__init__(db_connector, table_name, x_range, x_values, columns, lazy, cache, dtype)
\ No newline at end of file
@@ -0,0 +1,177 @@
+import cProfile
+import functools
+import json
+import os
+import resource
+import sys
+import time
+import threading
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager
+
+
+class JsonLinesSink():
+    """metrics sink writing one JSON object per line to a file path or an open stream
+    """
+    def __init__(self, target):
+        """_summary_
+        Args:
+            target (str or file): path to append to ("-" for stdout), or a writable text stream
+        """
+        if target == "-":
+            self.stream = sys.stdout
+        elif isinstance(target, str):
+            self.stream = open(target, "a")
+        else:
+            self.stream = target
+
+    def __call__(self, record):
+        self.stream.write(json.dumps(record, default=float) + "\n")
+        self.stream.flush()
+
+
+def peak_rss_kb():
+    """ high-water mark of the resident set size of this process in KiB; getrusage reports
+    ru_maxrss in KiB on Linux but in bytes on macOS
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == "darwin" else peak
+
+
+class Metrics():
+    """timers, counters and optional profiling for the pipeline stages.
+
+    Records are only built when a sink is attached or a stage is profiled, so the
+    instrumentation costs two attribute checks per stage when nothing listens.
+    A sink is any callable taking a dict.
+    """
+    def __init__(self):
+        self.sinks = []
+        self.counters = Counter()
+        self.profile_stages = set()
+        self.profile_dir = "."
+        self.trace_memory = False
+        # cProfile allows one active profiler per process (3.12+ raises, 3.11 silently stops the
+        # outer one), so a profiled stage nested in another is left to the outer profile
+        self.active_profile = None
+        self.profile_lock = threading.Lock()
+
+    def add_sink(self, sink):
+        """ attach a sink; returns it so callers can keep a handle
+        """
+        self.sinks.append(sink)
+        return sink
+
+    def configure(self, sink=None, profile=None, profile_dir=".", trace_memory=False):
+        """ one-call setup, used by the CLI and the PIPELINE_METRICS* environment variables
+
+        Args:
+            sink (str, optional): JSON lines target, see JsonLinesSink. Defaults to None.
+            profile (str, optional): comma separated stage names to run under cProfile, or "all". Defaults to None.
+            profile_dir (str, optional): where .prof files are written. Defaults to ".".
+            trace_memory (bool, optional): report the tracemalloc peak of each stage. Defaults to False.
+        """
+        if sink:
+            self.add_sink(JsonLinesSink(sink))
+        if profile:
+            self.profile_stages = set(profile.split(","))
+        self.profile_dir = profile_dir
+        self.trace_memory = trace_memory
+
+    def count(self, name, n=1):
+        """ increment a counter; counters are emitted by flush_counters()
+        """
+        self.counters[name] += n
+
+    def flush_counters(self):
+        """ emit all counters as one record and reset them
+        """
+        if self.sinks and self.counters:
+            self.emit({"stage": "counters", **self.counters})
+        self.counters.clear()
+
+    def emit(self, record):
+        for sink in self.sinks:
+            sink(record)
+
+    def profiled(self, name):
+        return "all" in self.profile_stages or name in self.profile_stages
+
+    def timed(self, name):
+        """ decorator running the whole function as stage name
+        """
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.stage(name):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    @contextmanager
+    def stage(self, name, **fields):
+        """ time a stage. The yielded dict can be filled with extra fields, e.g. rows.
+
+        Each record has stage, seconds, cpu_seconds, peak_rss_kb (process high-water mark),
+        rows_per_second when rows is set, and traced_peak_bytes with trace_memory. Nested
+        stages share one tracemalloc peak, so an inner stage resets the outer one's peak.
+        A profiled stage started while another is being profiled is not profiled itself: its
+        calls land in the outer .prof file, named in its record as profile.
+
+        Args:
+            name (str): stage name
+            fields: extra fields for the record
+        """
+        profiled = self.profiled(name)
+        if not self.sinks and not profiled:
+            yield fields
+            return
+
+        record = {"stage": name, **fields}
+        profiler = None
+        if profiled:
+            with self.profile_lock:
+                if self.active_profile is None:
+                    profiler = cProfile.Profile()
+                    self.active_profile = os.path.join(self.profile_dir, f"{name}-{int(time.time() * 1000)}.prof")
+                    path = self.active_profile
+                else:
+                    record["profile"] = self.active_profile
+        if self.trace_memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+            tracemalloc.reset_peak()
+        start = time.perf_counter()
+        cpu_start = time.process_time()
+        if profiler is not None:
+            try:
+                profiler.enable()
+            except ValueError:
+                # another profiler outside the pipeline, e.g. python -m cProfile, is active
+                profiler = None
+                with self.profile_lock:
+                    self.active_profile = None
+        try:
+            yield record
+        finally:
+            if profiler is not None:
+                profiler.disable()
+                with self.profile_lock:
+                    self.active_profile = None
+                profiler.dump_stats(path)
+                record["profile"] = path
+            record["seconds"] = time.perf_counter() - start
+            record["cpu_seconds"] = time.process_time() - cpu_start
+            record["peak_rss_kb"] = peak_rss_kb()
+            if self.trace_memory:
+                record["traced_peak_bytes"] = tracemalloc.get_traced_memory()[1]
+            if record.get("rows") is not None and record["seconds"] > 0:
+                record["rows_per_second"] = record["rows"] / record["seconds"]
+            self.emit(record)
+
+
+# process-wide registry used by the loaders, Trainer, Tester and Visualizer
+metrics = Metrics()
+metrics.configure(sink=os.environ.get("PIPELINE_METRICS"), profile=os.environ.get("PIPELINE_PROFILE"),
+                  profile_dir=os.environ.get("PIPELINE_PROFILE_DIR", "."), trace_memory=bool(os.environ.get("PIPELINE_TRACEMALLOC")))
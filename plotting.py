@@ -0,0 +1,90 @@
+import os
+import sys
+import numpy as np
+
+# above this many points a scatter plot is unreadable and slow; density mode draws a raster instead
+DENSITY_THRESHOLD = 200000
+
+
+def pyplot(headless=False):
+    """ import matplotlib.pyplot, switching to the Agg backend when the figure is only saved
+    or no display is available, so nothing blocks on a server
+
+    Args:
+        headless (bool, optional): force the Agg backend. Defaults to False.
+    """
+    import matplotlib
+    if headless or not has_display():
+        matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    return plt
+
+
+def has_display():
+    if sys.platform in ("darwin", "win32"):
+        return True
+    return bool(os.environ.get("DISPLAY") or os.environ.get("WAYLAND_DISPLAY"))
+
+
+def use_density(n_points, density=None):
+    """ density=None picks the mode from the number of points
+    """
+    return n_points > DENSITY_THRESHOLD if density is None else density
+
+
+def draw_points(ax, x, y, density=False, bins=512, color="gray", cmap="Greys", label=None, **scatter_args):
+    """ scatter plot, or a 2D histogram raster of the points in density mode
+
+    Empty bins are left transparent so several rasters can be overlaid.
+
+    Args:
+        ax (matplotlib.axes.Axes): target axes
+        x, y (np.ndarray): point coordinates
+        density (bool, optional): draw a raster instead of markers. Defaults to False.
+        bins (int, optional): raster bins per axis. Defaults to 512.
+        color (str, optional): marker color in scatter mode. Defaults to "gray".
+        cmap (str, optional): colormap in density mode. Defaults to "Greys".
+        label (str, optional): legend label. Defaults to None.
+    """
+    if not density:
+        return ax.scatter(x, y, c=color, label=label, **scatter_args)
+    if len(x) == 0:
+        return None
+
+    from matplotlib import colormaps
+    from matplotlib.colors import ListedColormap
+
+    counts, x_edges, y_edges = np.histogram2d(x, y, bins=bins)
+    # log scale: a few dense functions would otherwise wash out everything else
+    raster = np.ma.masked_equal(np.log1p(counts.T), 0)
+    # skip the near-white end of the colormap so single points stay visible
+    colormap = ListedColormap(colormaps[cmap](np.linspace(0.35, 1, 256)))
+    image = ax.imshow(raster, extent=(x_edges[0], x_edges[-1], y_edges[0], y_edges[-1]), origin="lower",
+                      aspect="auto", cmap=colormap, vmin=0, vmax=max(raster.max(), 1e-9), interpolation="nearest")
+    # imshow has no legend entry; a proxy marker in the raster's color stands in for it
+    if label is not None:
+        ax.scatter([], [], c=[image.cmap(0.8)], marker="s", label=label)
+    return image
+
+
+def finish(plt, fig, output=None, name="plot"):
+    """ save the figure to output, show it, or save it to <name>.png when there is no display
+
+    Args:
+        plt (module): matplotlib.pyplot from pyplot()
+        fig (matplotlib.figure.Figure): figure to finish
+        output (str, optional): PNG path. Defaults to None (show).
+        name (str, optional): file name stem used without a display. Defaults to "plot".
+
+    Returns:
+        str: path written, or None if the figure was shown
+    """
+    if output is None and not has_display():
+        output = f"{name}.png"
+    if output is None:
+        plt.show()
+        return None
+    fig.savefig(output, dpi=150)
+    plt.close(fig)
+    print(f"Plot saved as {output}")
+    return output
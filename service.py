@@ -0,0 +1,291 @@
+import asyncio
+import json
+import os
+import time
+from collections import deque
+import numpy as np
+from loader import DEFAULT_DB_PATH, DEFAULT_STORE_DIR, DBConnector, TrainDataloader, FunctionDataloader
+from test import Tester, OnlineMatcher
+
+
+class MatchService:
+    """Long-running matcher behind a Unix socket or a localhost TCP port.
+
+    The mapping, thresholds and chosen ideal columns are loaded once into an OnlineMatcher.
+    Requests from all connections go through one queue; the batching loop drains whatever is
+    queued (up to max_batch points) and matches it with a single vectorized call, so batches
+    grow with the load and an idle service adds no delay. The database is polled for commits
+    by other connections and the matcher is rebuilt when best_function_mapping changes.
+
+    Protocol: one JSON object per line each way. {"x": [...], "y": [...]} (or scalars) is
+    answered with {"deviation": [...], "ideal_function": [...], "ideal_y": [...]} in request
+    order, null where a point is unmatched. {"stats": true} returns the service counters.
+    """
+    def __init__(self, db_path=DEFAULT_DB_PATH, match_thresh=np.sqrt(2), max_batch=4096, max_delay=0.0, reload_interval=1.0,
+                 store_dir=DEFAULT_STORE_DIR):
+        """
+        Args:
+        db_path (str): database file. Defaults to DEFAULT_DB_PATH.
+        match_thresh (float): threshold factor on the max deviation. Defaults to sqrt(2).
+        max_batch (int): points per vectorized call. Defaults to 4096.
+        max_delay (float): seconds to wait for more requests before matching a batch. Defaults to 0
+            (match whatever is queued right away).
+        reload_interval (float): seconds between checks for a changed mapping. Defaults to 1.
+        store_dir (str, optional): column store the ideal columns are read from. Defaults to DEFAULT_STORE_DIR ($PIPELINE_STORE).
+        """
+        self.db_path = db_path
+        self.match_thresh = match_thresh
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.reload_interval = reload_interval
+
+        self.db = DBConnector(db_path=db_path, store_dir=store_dir)
+        self.data_version = self.db.conn.execute("PRAGMA data_version").fetchone()[0]
+        self.mapping = self.read_mapping()
+        self.matcher = self.load()
+        self.pending = None
+        self.latencies = deque(maxlen=100000)
+        self.stats = {"requests": 0, "points": 0, "batches": 0, "reloads": 0, "errors": 0}
+
+    def read_mapping(self):
+        return self.db.conn.execute("SELECT * FROM best_function_mapping ORDER BY train_function").fetchall()
+
+    def load(self):
+        """
+        Build the resident matcher; only the chosen ideal columns are read
+
+        Returns:
+        OnlineMatcher: matcher for the current mapping
+        """
+        tester = Tester(self.db, TrainDataloader(self.db, lazy=True), FunctionDataloader(self.db, lazy=True), None, self.match_thresh)
+        return OnlineMatcher(tester)
+
+    def check_reload(self):
+        """
+        Rebuild the matcher if another connection committed a different mapping. A failed
+        reload keeps the current matcher and is retried at the next check.
+
+        Returns:
+        bool: True if the matcher was replaced
+        """
+        data_version = self.db.conn.execute("PRAGMA data_version").fetchone()[0]
+        if data_version == self.data_version:
+            return False
+        try:
+            mapping = self.read_mapping()
+            matcher = self.load() if mapping != self.mapping else None
+        except Exception as e:
+            print(f"Reload failed, still serving the previous mapping: {e}")
+            return False
+        self.data_version = data_version
+        if matcher is None:
+            return False
+        self.matcher, self.mapping = matcher, mapping
+        self.stats["reloads"] += 1
+        print("best_function_mapping changed, matcher reloaded")
+        return True
+
+    async def watch(self):
+        while True:
+            await asyncio.sleep(self.reload_interval)
+            self.check_reload()
+
+    def match_batch(self, batch):
+        """
+        Match the concatenated points of several requests and resolve their futures
+
+        Args:
+        batch (list): (xs, ys, future, enqueue time) per request
+        """
+        matcher = self.matcher
+        xs = np.concatenate([item[0] for item in batch])
+        ys = np.concatenate([item[1] for item in batch])
+        deviation, best, ideal_y, is_matched = matcher.match_arrays(xs, ys)
+        deviation, best, ideal_y, is_matched = deviation.tolist(), best.tolist(), ideal_y.tolist(), is_matched.tolist()
+
+        now = time.perf_counter()
+        start = 0
+        for request_xs, _, future, enqueued in batch:
+            end = start + len(request_xs)
+            response = {"deviation": [], "ideal_function": [], "ideal_y": []}
+            for i in range(start, end):
+                if is_matched[i]:
+                    response["deviation"].append(deviation[i])
+                    response["ideal_function"].append(matcher.ideal_funcs[best[i]])
+                    response["ideal_y"].append(ideal_y[i])
+                else:
+                    response["deviation"].append(None)
+                    response["ideal_function"].append(None)
+                    response["ideal_y"].append(None)
+            start = end
+            if not future.done():
+                future.set_result(response)
+            self.latencies.append(now - enqueued)
+        self.stats["batches"] += 1
+        self.stats["points"] += len(xs)
+
+    async def batch_loop(self):
+        while True:
+            batch = [await self.pending.get()]
+            if self.max_delay > 0:
+                await asyncio.sleep(self.max_delay)
+            size = len(batch[0][0])
+            while size < self.max_batch and not self.pending.empty():
+                item = self.pending.get_nowait()
+                batch.append(item)
+                size += len(item[0])
+            try:
+                self.match_batch(batch)
+            except Exception as e:
+                for item in batch:
+                    if not item[2].done():
+                        item[2].set_exception(e)
+
+    def snapshot(self):
+        """ service counters plus server-side latency percentiles in milliseconds
+        """
+        latencies = np.array(self.latencies) * 1e3 if self.latencies else np.zeros(1)
+        return {**self.stats, "mean_batch_points": self.stats["points"] / max(self.stats["batches"], 1),
+                "p50_ms": float(np.percentile(latencies, 50)), "p99_ms": float(np.percentile(latencies, 99))}
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    request = json.loads(line)
+                    if request.get("stats"):
+                        response = self.snapshot()
+                    else:
+                        xs = np.atleast_1d(np.asarray(request["x"], dtype=np.float64))
+                        ys = np.atleast_1d(np.asarray(request["y"], dtype=np.float64))
+                        if xs.shape != ys.shape or xs.ndim != 1:
+                            raise ValueError("x and y must be numbers or lists of the same length")
+                        future = asyncio.get_running_loop().create_future()
+                        await self.pending.put((xs, ys, future, time.perf_counter()))
+                        response = await future
+                        self.stats["requests"] += 1
+                except Exception as e:
+                    self.stats["errors"] += 1
+                    response = {"error": str(e)}
+                writer.write(json.dumps(response).encode() + b"\n")
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def start(self, host="127.0.0.1", port=8765, socket_path=None):
+        """
+        Start listening and the batching and reload tasks
+
+        Returns:
+        asyncio.base_events.Server: the listening server
+        """
+        self.pending = asyncio.Queue()
+        self.tasks = [asyncio.create_task(self.batch_loop()), asyncio.create_task(self.watch())]
+        if socket_path:
+            if os.path.exists(socket_path):
+                os.remove(socket_path)
+            server = await asyncio.start_unix_server(self.handle, path=socket_path)
+            print(f"Match service listening on {socket_path}")
+        else:
+            server = await asyncio.start_server(self.handle, host, port)
+            print(f"Match service listening on {host}:{port}")
+        return server
+
+    async def stop(self, server):
+        server.close()
+        await server.wait_closed()
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+
+    def close(self):
+        self.db.close()
+
+
+async def open_client(host="127.0.0.1", port=8765, socket_path=None):
+    if socket_path:
+        return await asyncio.open_unix_connection(socket_path)
+    return await asyncio.open_connection(host, port)
+
+
+async def request(reader, writer, message):
+    """ send one request line and wait for its response
+    """
+    writer.write(json.dumps(message).encode() + b"\n")
+    await writer.drain()
+    return json.loads(await reader.readline())
+
+
+async def benchmark_service(xs, ys, clients=32, requests=200, points=1, host="127.0.0.1", port=8765, socket_path=None):
+    """
+    Closed-loop load test: clients connections each send requests sequential requests
+
+    Args:
+    xs, ys (array-like): test points, sent round-robin.
+    clients (int): concurrent connections. Defaults to 32.
+    requests (int): requests per connection. Defaults to 200.
+    points (int): points per request. Defaults to 1.
+
+    Returns:
+    dict: requests per second and client-side p50/p99 latency in milliseconds
+    """
+    xs = [float(x) for x in xs]
+    ys = [float(y) for y in ys]
+    latencies = []
+
+    async def client(offset):
+        reader, writer = await open_client(host, port, socket_path)
+        for i in range(requests):
+            start = (offset * requests + i) * points
+            picks = [(start + j) % len(xs) for j in range(points)]
+            began = time.perf_counter()
+            response = await request(reader, writer, {"x": [xs[p] for p in picks], "y": [ys[p] for p in picks]})
+            latencies.append(time.perf_counter() - began)
+            if "error" in response:
+                raise RuntimeError(response["error"])
+        writer.close()
+
+    print("===============match service benchmark================")
+    start = time.perf_counter()
+    await asyncio.gather(*(client(c) for c in range(clients)))
+    elapsed = time.perf_counter() - start
+    latencies = np.array(latencies) * 1e3
+    results = {
+        "requests_per_second": len(latencies) / elapsed,
+        "points_per_second": len(latencies) * points / elapsed,
+        "p50_ms": float(np.percentile(latencies, 50)),
+        "p99_ms": float(np.percentile(latencies, 99)),
+    }
+    print(f"{clients} clients x {requests} requests x {points} points: {results['requests_per_second']:.0f} req/s, "
+          f"p50 = {results['p50_ms']:.2f} ms, p99 = {results['p99_ms']:.2f} ms")
+    print("======================================================")
+    return results
+
+
+async def serve(service, host="127.0.0.1", port=8765, socket_path=None):
+    server = await service.start(host, port, socket_path)
+    try:
+        await server.serve_forever()
+    finally:
+        await service.stop(server)
+
+
+async def serve_and_benchmark(service, host="127.0.0.1", port=8765, socket_path=None, **bench_args):
+    """ start the service, run benchmark_service() against it on the stored test points, stop
+    """
+    server = await service.start(host, port, socket_path)
+    try:
+        test_df = service.db.conn.execute("SELECT x, y FROM test_data ORDER BY rowid").fetchall()
+        xs, ys = zip(*test_df)
+        results = await benchmark_service(xs, ys, host=host, port=port, socket_path=socket_path, **bench_args)
+        stats = service.snapshot()
+        print(f"server: {stats['batches']} batches, {stats['mean_batch_points']:.1f} points per batch, "
+              f"p99 queue+match = {stats['p99_ms']:.2f} ms")
+        return results
+    finally:
+        await service.stop(server)
@@ -0,0 +1,159 @@
+import hashlib
+import json
+import sqlite3
+import time
+import numpy as np
+
+
+def file_fingerprint(paths, block_size=1 << 20):
+    """ sha256 over the contents of the given files, read in blocks
+
+    Args:
+        paths (list): files to hash, in a fixed order
+        block_size (int, optional): bytes per read. Defaults to 1 MiB.
+
+    Returns:
+        str: hex digest
+    """
+    digest = hashlib.sha256()
+    for path in paths:
+        digest.update(path.encode() + b"\0")
+        with open(path, "rb") as f:
+            while True:
+                block = f.read(block_size)
+                if not block:
+                    break
+                digest.update(block)
+    return digest.hexdigest()
+
+
+def table_fingerprint(conn, tables, chunksize=100000):
+    """ sha256 over the schema and rows of the given tables, streamed in rowid order
+
+    Numeric chunks are hashed as float64 bytes; chunks holding text fall back to their repr.
+
+    Args:
+        conn (sqlite3.Connection): database connection
+        tables (list): tables to hash, in a fixed order
+        chunksize (int, optional): rows per fetch. Defaults to 100000.
+
+    Returns:
+        str: hex digest
+    """
+    digest = hashlib.sha256()
+    for table_name in tables:
+        columns = [row[1] for row in conn.execute(f"PRAGMA table_info({table_name})")]
+        if not columns:
+            digest.update(f"{table_name}:missing".encode())
+            continue
+        digest.update(f"{table_name}({','.join(columns)})".encode())
+        cursor = conn.execute(f"SELECT * FROM {table_name} ORDER BY rowid")
+        while True:
+            rows = cursor.fetchmany(chunksize)
+            if not rows:
+                break
+            try:
+                digest.update(np.array(rows, dtype=np.float64).tobytes())
+            except (TypeError, ValueError):
+                digest.update(repr(rows).encode())
+    return digest.hexdigest()
+
+
+def table_token(conn, table_name):
+    """ cheap stand-in for table_fingerprint() on a table loaded by ingest
+
+    Chains the checksum ingest recorded in table_checksums with the current row count and largest
+    rowid, so appended or deleted rows change the token without hashing a single row. Tables
+    without a recorded checksum fall back to table_fingerprint(). In-place UPDATEs of ingested
+    rows are not seen; rerun the stage with --force after editing a table by hand.
+
+    Args:
+        conn (sqlite3.Connection): database connection
+        table_name (str): table to fingerprint
+
+    Returns:
+        str: hex digest
+    """
+    try:
+        checksum = conn.execute("SELECT checksum FROM table_checksums WHERE table_name = ?", (table_name,)).fetchone()
+        if checksum is not None:
+            count, max_rowid = conn.execute(f"SELECT COUNT(*), MAX(rowid) FROM {table_name}").fetchone()
+            return combine_fingerprints(table_name, checksum[0], count, max_rowid)
+    except sqlite3.OperationalError:
+        pass
+    return table_fingerprint(conn, [table_name])
+
+
+def combine_fingerprints(*parts):
+    """ one digest over several fingerprints and JSON-serializable parameters
+    """
+    return hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode()).hexdigest()
+
+
+class StageCache():
+    """records the input fingerprint of each pipeline stage in the stage_fingerprints table of
+    functions.db, so a stage whose inputs did not change can be skipped and its stored output reused
+    """
+    def __init__(self, db_path):
+        """_summary_
+        Args:
+            db_path (str): database holding the stage outputs and the fingerprint table
+        """
+        self.conn = sqlite3.connect(db_path)
+        self.conn.execute("""
+        CREATE TABLE IF NOT EXISTS stage_fingerprints (
+            stage TEXT PRIMARY KEY,
+            fingerprint TEXT,
+            updated_at REAL
+        );
+        """)
+        self.conn.commit()
+
+    def get(self, stage):
+        """ stored fingerprint of stage, None if it never ran
+        """
+        row = self.conn.execute("SELECT fingerprint FROM stage_fingerprints WHERE stage = ?", (stage,)).fetchone()
+        return row[0] if row else None
+
+    def is_fresh(self, stage, fingerprint, outputs=()):
+        """ whether stage already ran on these inputs and its output tables still exist
+
+        Args:
+            stage (str): stage name
+            fingerprint (str): fingerprint of the current inputs
+            outputs (tuple, optional): tables the stage writes. Defaults to ().
+        """
+        if self.get(stage) != fingerprint:
+            return False
+        existing = {row[0] for row in self.conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        return all(table in existing for table in outputs)
+
+    def record(self, stage, fingerprint):
+        """ store the fingerprint of a successful run
+        """
+        self.conn.execute("INSERT OR REPLACE INTO stage_fingerprints (stage, fingerprint, updated_at) VALUES (?, ?, ?)",
+                          (stage, fingerprint, time.time()))
+        self.conn.commit()
+
+    def run(self, stage, fingerprint, func, outputs=(), force=False):
+        """ run func unless stage is fresh, then record the fingerprint
+
+        Args:
+            stage (str): stage name
+            fingerprint (str): fingerprint of the current inputs
+            func (callable): runs the stage
+            outputs (tuple, optional): tables the stage writes. Defaults to ().
+            force (bool, optional): run even if the fingerprint is unchanged. Defaults to False.
+
+        Returns:
+            bool: True if func ran, False if the stage was skipped
+        """
+        if not force and self.is_fresh(stage, fingerprint, outputs):
+            print(f"{stage}: inputs unchanged, reusing stored output (use --force to rerun)")
+            return False
+        func()
+        self.record(stage, fingerprint)
+        return True
+
+    def close(self):
+        self.conn.close()
@@ -1,16 +1,40 @@
-import sqlite3
+import os
+import queue
+import threading
+import time
+import multiprocessing as mp
 import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
 from loader import *
 
+TEST_MAPPING_DDL = """
+        CREATE TABLE IF NOT EXISTS test_mapping (
+            X REAL,
+            Y REAL,          
+            Delta_Y REAL,
+            Ideal_Function TEXT,
+            Best_ideal_y REAL
+        );
+        """
+TEST_MAPPING_INSERT = "INSERT INTO test_mapping (X, Y, Delta_Y, Ideal_Function, Best_ideal_y) VALUES (?, ?, ?, ?, ?)"
+# BulkMatcher writes here and renames the table to test_mapping once every chunk is in
+TEST_MAPPING_STAGING = "test_mapping_staging"
+# seconds between checks of the BulkMatcher queues for failed or dead processes
+BULK_POLL_SECONDS = 0.5
+
 class Tester:
     """_Tester class for matching test data with the best ideal functions
     """
-    def __init__(self, db_connector, train_loader, function_loader, test_loader, match_thresh=np.sqrt(2)):
+    def __init__(self, db_connector, train_loader, function_loader, test_loader, match_thresh=np.sqrt(2), match_loader=None):
+        """
+        Args:
+        match_loader (Dataloader, optional): ideal function rows used for matching, e.g. a
+            FunctionDataloader restricted to the test x values. Defaults to function_loader.
+        """
         self.db = db_connector
         self.train_loader = train_loader
         self.function_loader = function_loader
+        self.match_loader = match_loader if match_loader is not None else function_loader
         self.test_loader = test_loader
         self.threshold_factor =  match_thresh
         try:
@@ -21,6 +45,7 @@ class Tester:
         print("Test data loaded successfully!")
         print("Best function mappings:", self.best_functions)
 
+    @metrics.timed("tester.calculate_max_deviation")
     def calculate_max_deviation(self):
         """Calculate the maximum deviation between training data and the best ideal functions
 
@@ -29,23 +54,123 @@ class Tester:
         """
         max_deviation = {}
 
-
+        # thresholds persisted by the Trainer next to the mapping; recompute only when missing
+        if "max_deviation" in self.best_functions.columns and self.best_functions["max_deviation"].notna().all():
+            for _, row in self.best_functions.iterrows():
+                max_deviation[row["ideal_function"]] = row["max_deviation"]
+            print("Maximum deviation between training and ideal functions:", max_deviation)
+            return max_deviation
 
         for _, row in self.best_functions.iterrows():
             train_func = row["train_function"]
             ideal_func = row["ideal_function"]
 
-            deviation = abs(self.train_loader.df[train_func] - self.function_loader.df[ideal_func])
-            max_deviation[ideal_func] = deviation.max()
+            max_deviation[ideal_func] = column_max_deviation(self.train_loader, self.function_loader, train_func, ideal_func)
 
         print("Maximum deviation between training and ideal functions:", max_deviation)
         return max_deviation
 
 
-    def match_test_data(self):
+    def build_x_index(self):
+        """
+        Build a sorted x -> row index over the ideal functions, used for batched lookups
+
+        Returns:
+        tuple: sorted x values and the row position of each sorted value
+        """
+        ideal_x = self.match_loader.column("x").to_numpy()
+        order = np.argsort(ideal_x, kind="stable")
+        return ideal_x[order], order
+
+    def lookup_rows(self, x_values, x_index=None):
+        """
+        Find the ideal function row for each x value with a binary search
+
+        Args:
+        x_values (np.ndarray): x values to look up.
+        x_index (tuple, optional): result of build_x_index(). Built on demand if omitted.
+
+        Returns:
+        tuple: row positions and a boolean mask telling which x values were found
+        """
+        sorted_x, order = x_index if x_index is not None else self.build_x_index()
+        if len(sorted_x) == 0:
+            return np.zeros(len(x_values), dtype=np.intp), np.zeros(len(x_values), dtype=bool)
+
+        pos = np.searchsorted(sorted_x, x_values)
+        pos = np.minimum(pos, len(sorted_x) - 1)
+        found = sorted_x[pos] == x_values
+        return order[pos], found
+
+    def match_test_data(self, mode="batch"):
         """
         Match test data against the best ideal functions based on deviation threshold
 
+        Args:
+        mode (str): "batch" gathers all ideal values with one indexed lookup and masks the
+            thresholds as arrays, "loop" is the original row-by-row scan. Both give identical output.
+
+        Returns:
+        tuple: Matched and unmatched test data
+        """
+        with metrics.stage("tester.match_test_data", mode=mode) as record:
+            if mode == "batch" and self.match_loader.column("x").is_unique:
+                matched_test_data, unmatched_test_data = self.match_test_data_batch()
+            else:
+                record["mode"] = "loop"
+                matched_test_data, unmatched_test_data = self.match_test_data_loop()
+            record["rows"] = len(matched_test_data) + len(unmatched_test_data)
+            record["matched"] = len(matched_test_data)
+        metrics.count("tester.matched", len(matched_test_data))
+        metrics.count("tester.unmatched", len(unmatched_test_data))
+        return matched_test_data, unmatched_test_data
+
+    def match_test_data_batch(self):
+        """
+        Vectorized matcher: one x lookup for every test point, one gather of the chosen ideal
+        columns, and the sqrt(2) * max_deviation thresholds applied as a mask. Requires unique x
+        values in the ideal table; match_test_data() falls back to the loop otherwise.
+
+        Returns:
+        tuple: Matched and unmatched test data
+        """
+        max_deviation = self.calculate_max_deviation()
+        ideal_funcs = self.best_functions["ideal_function"].tolist()
+
+        x_test = self.test_loader.df["x"].to_numpy()
+        y_test = self.test_loader.df["y"].to_numpy()
+        rows, found = self.lookup_rows(x_test)
+
+        # gather first, then widen: only (test points, chosen functions) values become float64
+        ideal_y = self.match_loader.array(ideal_funcs)[rows].astype(np.float64)
+        deviation = np.abs(y_test[:, None] - ideal_y)
+        thresholds = np.array([self.threshold_factor * max_deviation[f] for f in ideal_funcs])
+        within = found[:, None] & (deviation <= thresholds)
+
+        # argmin returns the first minimum, i.e. the same function the strict < scan keeps
+        best = np.argmin(np.where(within, deviation, np.inf), axis=1)
+        is_matched = within.any(axis=1)
+        idx = np.arange(len(x_test))
+        best_deviation = deviation[idx, best]
+        best_ideal_y = ideal_y[idx, best]
+
+        matched_test_data = []
+        unmatched_test_data = []
+        for i in range(len(x_test)):
+            if is_matched[i]:
+                matched_test_data.append((x_test[i], y_test[i], best_deviation[i], ideal_funcs[best[i]], best_ideal_y[i]))
+            else:
+                unmatched_test_data.append((x_test[i], y_test[i], float("inf"), None, None))
+
+        print("Test data matching completed!")
+        print("Final matching results (first 10 entries):", matched_test_data[:10])  
+
+        return matched_test_data, unmatched_test_data
+
+    def match_test_data_loop(self):
+        """
+        Match test data row by row (reference implementation)
+
         Returns:
         tuple: Matched and unmatched test data
         """
@@ -53,6 +178,8 @@ class Tester:
         matched_test_data = []
         unmatched_test_data = []
 
+        # compact loaders build df on every access
+        ideal_df = self.match_loader.df
         for _, test_row in self.test_loader.df.iterrows():
             x_test, y_test = test_row["x"], test_row["y"]
             best_match = None
@@ -61,7 +188,7 @@ class Tester:
 
             for _, row in self.best_functions.iterrows():
                 ideal_func = row["ideal_function"]
-                ideal_y_candidates = self.function_loader.df.loc[self.function_loader.df["x"] == x_test, ideal_func].values
+                ideal_y_candidates = ideal_df.loc[ideal_df["x"] == x_test, ideal_func].values
 
                 if len(ideal_y_candidates) > 0:  
                     for ideal_y in ideal_y_candidates: 
@@ -91,24 +218,14 @@ class Tester:
         Parameters:
         matched_test_data (list): List of matched test data tuples.
         """
-        cursor = self.db.conn.cursor()
-        cursor.execute("DROP TABLE IF EXISTS test_mapping") 
-        cursor.execute("""
-        CREATE TABLE IF NOT EXISTS test_mapping (
-            X REAL,
-            Y REAL,          
-            Delta_Y REAL,
-            Ideal_Function TEXT,
-            Best_ideal_y REAL
-        );
-        """)
+        with metrics.stage("tester.save_matched_data", rows=len(matched_test_data)):
+            cursor = self.db.conn.cursor()
+            cursor.execute("DROP TABLE IF EXISTS test_mapping") 
+            cursor.execute(TEST_MAPPING_DDL)
 
-        cursor.executemany(
-            "INSERT INTO test_mapping (X, Y, Delta_Y, Ideal_Function, Best_ideal_y) VALUES (?, ?, ?, ?, ?)",
-            matched_test_data
-        )
+            cursor.executemany(TEST_MAPPING_INSERT, matched_test_data)
 
-        self.db.conn.commit()
+            self.db.conn.commit()
         print("Matched test data saved in the database!")
 
     def run(self):
@@ -125,6 +242,312 @@ class Tester:
     
 
 
+class OnlineMatcher:
+    """Resident matcher for scoring test points one at a time. Thresholds and the
+    x lookup table are computed once from a Tester, so match() is a dict lookup plus
+    a scan over the few chosen functions.
+    """
+    def __init__(self, tester):
+        """
+        Precompute thresholds and the x -> ideal values table
+
+        Args:
+        tester (Tester): Tester whose loaders and best_function_mapping are used.
+        """
+        self.tester = tester
+        max_deviation = tester.calculate_max_deviation()
+        self.ideal_funcs = tester.best_functions["ideal_function"].tolist()
+        self.thresholds = [float(tester.threshold_factor * max_deviation[f]) for f in self.ideal_funcs]
+
+        ideal_x = tester.match_loader.column("x").to_numpy()
+        self.ideal_y = tester.match_loader.array(self.ideal_funcs).astype(np.float64)
+        self.x_index = tester.build_x_index()
+
+        # plain python floats: cheaper than numpy scalars for a handful of functions
+        ideal_rows = self.ideal_y.tolist()
+        self.lookup = {}
+        for x, row in zip(ideal_x.tolist(), ideal_rows):
+            self.lookup.setdefault(x, row)
+
+    def match(self, x, y):
+        """
+        Match a single test point
+
+        Args:
+        x (float): test x value.
+        y (float): test y value.
+
+        Returns:
+        tuple: (x, y, deviation, ideal_function, ideal_y) or (x, y, inf, None, None) if unmatched
+        """
+        row = self.lookup.get(x)
+        best_deviation = float("inf")
+        best_match = None
+        best_ideal_y = None
+
+        if row is not None:
+            for ideal_func, ideal_y, threshold in zip(self.ideal_funcs, row, self.thresholds):
+                deviation = abs(y - ideal_y)
+                if deviation <= threshold and deviation < best_deviation:
+                    best_deviation = deviation
+                    best_match = ideal_func
+                    best_ideal_y = ideal_y
+
+        return (x, y, best_deviation, best_match, best_ideal_y)
+
+    def match_many(self, xs, ys):
+        """
+        Match a batch of test points with the vectorized path
+
+        Args:
+        xs (array-like): test x values.
+        ys (array-like): test y values.
+
+        Returns:
+        tuple: Matched and unmatched test data, in the same shape as Tester.match_test_data()
+        """
+        xs = np.asarray(xs, dtype=np.float64)
+        ys = np.asarray(ys, dtype=np.float64)
+        deviation, best, ideal_y, is_matched = self.match_arrays(xs, ys)
+
+        matched_test_data = []
+        unmatched_test_data = []
+        for i in range(len(xs)):
+            if is_matched[i]:
+                matched_test_data.append((xs[i], ys[i], deviation[i], self.ideal_funcs[best[i]], ideal_y[i]))
+            else:
+                unmatched_test_data.append((xs[i], ys[i], float("inf"), None, None))
+        return matched_test_data, unmatched_test_data
+
+    def match_arrays(self, xs, ys):
+        """
+        Vectorized matching that keeps the input order, one entry per point
+
+        Args:
+        xs (np.ndarray): test x values.
+        ys (np.ndarray): test y values.
+
+        Returns:
+        tuple: deviation, index into ideal_funcs and ideal y of the best function, and the matched
+            mask; the first three are meaningless where the mask is False
+        """
+        rows, found = self.tester.lookup_rows(xs, self.x_index)
+
+        ideal_y = self.ideal_y[rows]
+        deviation = np.abs(ys[:, None] - ideal_y)
+        within = found[:, None] & (deviation <= np.array(self.thresholds))
+        best = np.argmin(np.where(within, deviation, np.inf), axis=1)
+        points = np.arange(len(xs))
+        return deviation[points, best], best, ideal_y[points, best], within.any(axis=1)
+
+
+def bulk_match_worker(matcher, task_queue, result_queue):
+    """
+    Matcher process of BulkMatcher: match chunks from task_queue until the None sentinel
+
+    Args:
+    matcher (OnlineMatcher): inherited from the parent through fork.
+    task_queue (mp.Queue): (seq, xs, ys) chunks.
+    result_queue (mp.Queue): (seq, matched rows, unmatched count, error) results.
+    """
+    while True:
+        task = task_queue.get()
+        if task is None:
+            result_queue.put(None)
+            return
+        seq, xs, ys = task
+        try:
+            matched, unmatched = matcher.match_many(xs, ys)
+            rows = [(float(x), float(y), float(d), f, float(iy)) for x, y, d, f, iy in matched]
+            result_queue.put((seq, rows, len(unmatched), None))
+        except Exception as e:
+            result_queue.put((seq, None, 0, repr(e)))
+
+class BulkMatcher:
+    """Out-of-core matching pipeline: a reader streams test rows from SQLite in chunks, a pool
+    of matcher processes matches them, and a writer thread appends the results to a staging
+    table in batched transactions, in test row order. All queues are bounded, so memory stays flat
+    however large test_data is. The staging table replaces test_mapping only when every chunk is
+    in, with the same rows as Tester.run(); a failed run, including a matcher process that dies,
+    raises and leaves the previous test_mapping in place.
+    """
+    def __init__(self, tester, chunksize=100000, workers=None, queue_size=4, batch_size=100000, test_table="test_data"):
+        """
+        Args:
+        tester (Tester): provides the mapping, thresholds and ideal rows; its test_loader is not used.
+        chunksize (int): test rows per chunk. Defaults to 100000.
+        workers (int, optional): matcher processes. Defaults to os.cpu_count().
+        queue_size (int): chunks buffered per queue. Defaults to 4.
+        batch_size (int): rows per write transaction. Defaults to 100000.
+        test_table (str): table holding the test points. Defaults to "test_data".
+        """
+        self.tester = tester
+        self.chunksize = chunksize
+        self.workers = workers or os.cpu_count() or 1
+        self.queue_size = queue_size
+        self.batch_size = batch_size
+        self.test_table = test_table
+        if not tester.match_loader.column("x").is_unique:
+            raise ValueError("BulkMatcher needs unique x values in the ideal table; use Tester.run() instead")
+        self.matcher = OnlineMatcher(tester)
+
+    def read_chunks(self):
+        """
+        Yield (xs, ys) chunks in rowid order. Each chunk is a separate keyset query, so no read
+        lock is held between chunks and the writer can commit meanwhile.
+        """
+        last_rowid = 0
+        while True:
+            with self.tester.db.reader() as conn:
+                rows = conn.execute(
+                    f"SELECT rowid, x, y FROM {self.test_table} WHERE rowid > ? ORDER BY rowid LIMIT ?",
+                    (last_rowid, self.chunksize)).fetchall()
+            if not rows:
+                return
+            block = np.array(rows, dtype=np.float64)
+            last_rowid = int(block[-1, 0])
+            yield block[:, 1], block[:, 2]
+
+    def write_results(self, result_queue, state, processes):
+        """
+        Writer thread: reorder results by chunk sequence, insert them into the staging table in
+        batched transactions and swap it in for test_mapping once every worker finished. Stops
+        at the first error, including a worker that exited without its sentinel (OOM kill,
+        os._exit), which would otherwise leave it waiting on the queue forever.
+
+        Args:
+        result_queue (mp.Queue): worker results.
+        state (dict): shared counters and error slot.
+        processes (list): the matcher processes.
+        """
+        conn = self.tester.db.connect()
+        insert_sql = TEST_MAPPING_INSERT.replace("test_mapping", TEST_MAPPING_STAGING, 1)
+        pending = {}
+        next_seq = 0
+        batch = []
+        finished_workers = 0
+        lost = False
+        try:
+            conn.execute(f"DROP TABLE IF EXISTS {TEST_MAPPING_STAGING}")
+            conn.execute(TEST_MAPPING_DDL.replace("test_mapping", TEST_MAPPING_STAGING, 1))
+            conn.commit()
+            while finished_workers < self.workers and state["error"] is None:
+                try:
+                    result = result_queue.get(timeout=BULK_POLL_SECONDS)
+                except queue.Empty:
+                    # a worker flushes its sentinel before exiting, so an exited worker whose
+                    # sentinel is still missing a full poll later died without sending it
+                    exit_codes = [p.exitcode for p in processes if p.exitcode is not None]
+                    if len(exit_codes) > finished_workers:
+                        if lost:
+                            state["error"] = state["error"] or f"a matcher process died (exit codes {exit_codes})"
+                        lost = True
+                    continue
+                lost = False
+                if result is None:
+                    finished_workers += 1
+                    continue
+                seq, rows, unmatched, error = result
+                if error is not None:
+                    state["error"] = state["error"] or error
+                    continue
+                pending[seq] = (rows, unmatched)
+                while next_seq in pending:
+                    rows, unmatched = pending.pop(next_seq)
+                    batch += rows
+                    state["matched"] += len(rows)
+                    state["unmatched"] += unmatched
+                    next_seq += 1
+                    if len(batch) >= self.batch_size:
+                        conn.executemany(insert_sql, batch)
+                        conn.commit()
+                        batch = []
+            if state["error"] is None:
+                if batch:
+                    conn.executemany(insert_sql, batch)
+                    conn.commit()
+                conn.execute("BEGIN")
+                conn.execute("DROP TABLE IF EXISTS test_mapping")
+                conn.execute(f"ALTER TABLE {TEST_MAPPING_STAGING} RENAME TO test_mapping")
+                conn.commit()
+            else:
+                conn.rollback()
+                conn.execute(f"DROP TABLE IF EXISTS {TEST_MAPPING_STAGING}")
+                conn.commit()
+        except Exception as e:
+            state["error"] = state["error"] or repr(e)
+        finally:
+            conn.close()
+
+    def put_task(self, task_queue, task, state):
+        """
+        Put task on the bounded task queue, giving up once the pipeline failed, so the reader
+        never blocks on a queue nobody drains
+
+        Returns:
+        bool: True if the task was queued
+        """
+        while state["error"] is None:
+            try:
+                task_queue.put(task, timeout=BULK_POLL_SECONDS)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def run(self):
+        """
+        Run the pipeline
+
+        Returns:
+        tuple: number of matched and unmatched test points
+        """
+        ctx = mp.get_context("fork")
+        task_queue = ctx.Queue(maxsize=self.queue_size)
+        result_queue = ctx.Queue(maxsize=self.queue_size)
+        state = {"matched": 0, "unmatched": 0, "error": None}
+
+        processes = [ctx.Process(target=bulk_match_worker, args=(self.matcher, task_queue, result_queue), daemon=True)
+                     for _ in range(self.workers)]
+        for process in processes:
+            process.start()
+        writer = threading.Thread(target=self.write_results, args=(result_queue, state, processes), daemon=True)
+        writer.start()
+
+        start = time.perf_counter()
+        try:
+            for seq, (xs, ys) in enumerate(self.read_chunks()):
+                if not self.put_task(task_queue, (seq, xs, ys), state):
+                    break
+        except BaseException as e:
+            # the writer must not swap in a partial table
+            state["error"] = state["error"] or repr(e)
+            raise
+        finally:
+            for _ in processes:
+                if not self.put_task(task_queue, None, state):
+                    break
+            writer.join()
+            if state["error"] is not None:
+                # tasks nobody will read must not hold up interpreter exit
+                task_queue.cancel_join_thread()
+            for process in processes:
+                if state["error"] is not None:
+                    process.kill()
+                process.join()
+
+        if state["error"] is not None:
+            raise RuntimeError(f"bulk matching failed: {state['error']}")
+        elapsed = time.perf_counter() - start
+        if metrics.sinks:
+            metrics.emit({"stage": "bulk_matcher.run", "seconds": elapsed, "rows": state["matched"] + state["unmatched"],
+                          "matched": state["matched"], "workers": self.workers})
+        total = state["matched"] + state["unmatched"]
+        print(f"Bulk matching: {total} test points in {elapsed:.2f}s ({total / max(elapsed, 1e-9):.0f} points/s), "
+              f"{state['matched']} matched, {state['unmatched']} unmatched")
+        return state["matched"], state["unmatched"]
+
+
 def test_unit_test(tester):
     """
     Perform a unit test to verify test data matching
@@ -140,6 +563,19 @@ def test_unit_test(tester):
         f"test data count: 匹配 {total_matched} + 未匹配 {total_unmatched} ≠ 总测试 {total_test_cases}"
     )
 
+    loop_matched, loop_unmatched = tester.match_test_data(mode="loop")
+    assert matched_test_data == loop_matched and unmatched_test_data == loop_unmatched, (
+        "batch matcher disagrees with the row-by-row matcher"
+    )
+
+    matcher = OnlineMatcher(tester)
+    online_matched, online_unmatched = matcher.match_many(tester.test_loader.df["x"], tester.test_loader.df["y"])
+    assert online_matched == matched_test_data and len(online_unmatched) == total_unmatched, (
+        "online matcher disagrees with the batch matcher"
+    )
+    single = [matcher.match(x, y) for x, y in zip(tester.test_loader.df["x"], tester.test_loader.df["y"])]
+    assert [t for t in single if t[3] is not None] == matched_test_data, "OnlineMatcher.match() disagrees with the batch matcher"
+
     print("total_matched :" , total_matched)
     print("total_unmatched :" , total_unmatched)
     print("total_test_cases :" , total_test_cases)
@@ -147,16 +583,78 @@ def test_unit_test(tester):
     
     print("================================================")
 
-def main():
-    db_connector =DBConnector(db_path="/Users/lincong/Desktop/python_course/assignment/Dataset/functions.db")
-    train_loader = TrainDataloader(db_connector)
-    function_loader =FunctionDataloader(db_connector)
+def benchmark_online_matcher(matcher, xs, ys, repeat=20):
+    """
+    Measure per-point latency of OnlineMatcher.match()
+
+    Args:
+    matcher (OnlineMatcher): resident matcher.
+    xs, ys (array-like): test points replayed repeat times.
+
+    Returns:
+    dict: p50/p99/max latency in microseconds and number of calls
+    """
+    print("===============online matcher benchmark================")
+    xs = [float(x) for x in xs]
+    ys = [float(y) for y in ys]
+    latencies = []
+    for _ in range(repeat):
+        for x, y in zip(xs, ys):
+            start = time.perf_counter()
+            matcher.match(x, y)
+            latencies.append(time.perf_counter() - start)
+
+    latencies = np.array(latencies) * 1e6
+    results = {
+        "p50_us": float(np.percentile(latencies, 50)),
+        "p99_us": float(np.percentile(latencies, 99)),
+        "max_us": float(latencies.max()),
+        "calls": len(latencies),
+    }
+    print(f"match() latency over {results['calls']} calls: p50 = {results['p50_us']:.2f} us, p99 = {results['p99_us']:.2f} us")
+    print("=======================================================")
+    return results
+
+def main(db_path=DEFAULT_DB_PATH, bulk=False, workers=None, chunksize=100000, match_thresh=np.sqrt(2), unit_test=False, dtype=None,
+         store_dir=DEFAULT_STORE_DIR):
+    """
+    Args:
+    db_path (str): database file. Defaults to DEFAULT_DB_PATH.
+    bulk (bool): match with the out-of-core BulkMatcher pipeline instead of Tester.run(). Defaults to False.
+    workers (int, optional): BulkMatcher processes. Defaults to os.cpu_count().
+    chunksize (int): BulkMatcher test rows per chunk. Defaults to 100000.
+    match_thresh (float): threshold factor on the max deviation. Defaults to sqrt(2).
+    unit_test (bool): run test_unit_test() and the online matcher benchmark afterwards. Defaults to False.
+    dtype (optional): np.float32 or np.float64 to load the train and ideal tables in compact mode;
+        test points stay float64. Defaults to None.
+    store_dir (str, optional): column store the loaders read from. Defaults to DEFAULT_STORE_DIR ($PIPELINE_STORE).
+
+    Returns:
+    tuple: Matched and unmatched test data, or their counts in bulk mode
+    """
+    db_connector =DBConnector(db_path=db_path, store_dir=store_dir)
+    if bulk:
+        tester = Tester(db_connector, TrainDataloader(db_connector, lazy=True, dtype=dtype), FunctionDataloader(db_connector, lazy=True, dtype=dtype), None, match_thresh)
+        counts = BulkMatcher(tester, chunksize=chunksize, workers=workers).run()
+        db_connector.close()
+        return counts
+
+    train_loader = TrainDataloader(db_connector, lazy=True, dtype=dtype)
+    function_loader =FunctionDataloader(db_connector, lazy=True, dtype=dtype)
     test_loader = TestDataloader(db_connector)
+    match_loader = FunctionDataloader(db_connector, x_values=test_loader.df["x"], lazy=True, dtype=dtype)
     
-    tester = Tester(db_connector, train_loader, function_loader, test_loader)
-    tester.run()
+    tester = Tester(db_connector, train_loader, function_loader, test_loader, match_thresh, match_loader=match_loader)
+    matched_test_data, unmatched_test_data = tester.run()
+
+    if unit_test:
+        test_unit_test(tester) 
 
-    test_unit_test(tester) 
+        matcher = OnlineMatcher(tester)
+        benchmark_online_matcher(matcher, tester.test_loader.df["x"], tester.test_loader.df["y"])
+    db_connector.close()
+    return matched_test_data, unmatched_test_data
 
-main()
+if __name__ == "__main__":
+    main(unit_test=True)
 
@@ -1,13 +1,331 @@
+import contextlib
+import hashlib
+import io
+import os
 import sqlite3
+import time
+from multiprocessing import Pool, shared_memory
 import pandas as pd
 import numpy as np
 from loader import *
+from stages import table_fingerprint, table_token
+
+# cap on the temporary copy of one block of centred ideal columns in sse_matrix()
+SSE_BLOCK_BYTES = 64 << 20
+# ideal columns gathered per exact re-score in top_k_candidates()
+RESCORE_BLOCK = 1024
+
+
+def row_centre(train_values):
+    """
+    Mean of the training values in each row, 0 where a row has none; the shift sse_matrix()
+    subtracts from train and ideal values alike
+    """
+    counts = np.sum(~np.isnan(train_values), axis=1)
+    return np.nansum(train_values, axis=1, dtype=np.float64) / np.maximum(counts, 1)
+
+
+def sse_matrix(train_values, ideal_values, block_size=4096, with_error=False):
+    """
+    SSE of every (train column, ideal column) pair using the expanded norm
+    sum((a - b)^2) = |a|^2 - 2 a.b + |b|^2, one matrix product per block of ideal columns.
+    Each row is first shifted by the mean of its training values: the SSE does not change, but
+    an offset shared by all columns no longer inflates the norms, which would otherwise cancel
+    and swamp differences between close candidates. float32 inputs keep the matrix product in
+    float32; norms and the result are float64.
+
+    Args::
+    train_values (np.ndarray): (rows, n_train) training values.
+    ideal_values (np.ndarray): (rows, n_ideal) ideal function values.
+    block_size (int): most ideal columns per matrix product; fewer when a block would exceed SSE_BLOCK_BYTES.
+    with_error (bool): also return a bound on the rounding error of every entry. Defaults to False.
+
+    Returns:
+    np.ndarray: (n_train, n_ideal) SSE matrix, or (SSE matrix, error bound matrix) with with_error
+    """
+    dtype = np.result_type(train_values, ideal_values)
+    shift = row_centre(train_values).astype(dtype)[:, None]
+    train_centred = np.subtract(train_values, shift, dtype=dtype)
+    train_sq = np.einsum("ij,ij->j", train_centred, train_centred, dtype=np.float64)
+    sse = np.empty((train_values.shape[1], ideal_values.shape[1]))
+    ideal_sq = np.empty(ideal_values.shape[1])
+
+    block_size = max(1, min(block_size, SSE_BLOCK_BYTES // max(ideal_values.shape[0] * dtype.itemsize, 1)))
+    for start in range(0, ideal_values.shape[1], block_size):
+        block = np.subtract(ideal_values[:, start:start + block_size], shift, dtype=dtype)
+        block_sq = np.einsum("ij,ij->j", block, block, dtype=np.float64)
+        ideal_sq[start:start + block.shape[1]] = block_sq
+        sse[:, start:start + block.shape[1]] = train_sq[:, None] - 2.0 * (train_centred.T @ block) + block_sq[None, :]
+
+    # the expanded form can go slightly negative through cancellation
+    np.maximum(sse, 0.0, out=sse)
+    if not with_error:
+        return sse
+    # worst-case rounding of the shift, the length-rows dot products and the float64 norms,
+    # relative to the centred norms; pessimistic, so pruning with it never drops the true minimum
+    scale = (train_values.shape[0] + 8) * (np.finfo(dtype).eps + np.finfo(np.float64).eps)
+    return sse, scale * (train_sq[:, None] + ideal_sq[None, :])
+
+def top_k_candidates(train_values, ideal_values, k, block_size=4096):
+    """
+    The k best ideal columns of each training column. The SSE matrix only prunes: every column
+    whose SSE could still be among the k smallest given the rounding error bound is re-scored
+    with exact differences in float64, so near-ties and exact ties rank like a direct loop.
+    Missing values are skipped in the re-score, like the pandas sum of the original loop; the
+    matrix can't bound those columns, so they are always re-scored.
+
+    Args::
+    train_values (np.ndarray): (rows, n_train) training values.
+    ideal_values (np.ndarray): (rows, n_ideal) ideal function values.
+    k (int): candidates per training column.
+    block_size (int): ideal columns per matrix product.
+
+    Returns:
+    tuple: (n_train, k) ideal column indices and their exact SSE, ascending, ties by column index
+    """
+    sse, error = sse_matrix(train_values, ideal_values, block_size, with_error=True)
+    k = min(k, sse.shape[1])
+    invalid = np.isnan(sse) | np.isnan(error)
+    low = np.where(invalid, 0.0, sse - error)
+    high = np.where(invalid, np.inf, sse + error)
+    # the k-th smallest upper bound; a column whose lower bound is above it can't be in the top k
+    threshold = np.partition(high, k - 1, axis=1)[:, k - 1]
+
+    idx = np.empty((sse.shape[0], k), dtype=np.intp)
+    exact = np.empty((sse.shape[0], k))
+    for i in range(sse.shape[0]):
+        cols = np.flatnonzero(low[i] <= threshold[i])
+        train_col = np.asarray(train_values[:, i:i + 1], dtype=np.float64)
+        scores = np.concatenate([
+            np.nansum((np.asarray(ideal_values[:, cols[start:start + RESCORE_BLOCK]], dtype=np.float64) - train_col) ** 2, axis=0)
+            for start in range(0, len(cols), RESCORE_BLOCK)])
+        order = np.argsort(scores, kind="stable")[:k]
+        idx[i] = cols[order]
+        exact[i] = scores[order]
+    return idx, exact
+
+def sse_shard(spec):
+    """
+    Worker for parallel_top_k: attach to the shared arrays and rank one range of ideal columns
+
+    Args::
+    spec (tuple): shared memory names, array shapes, column range, k and block size.
+
+    Returns:
+    tuple: global column indices and exact SSE of the shard's top-k, as from top_k_candidates()
+    """
+    train_name, ideal_name, train_shape, ideal_shape, dtype, start, stop, k, block_size = spec
+    train_shm = shared_memory.SharedMemory(name=train_name)
+    ideal_shm = shared_memory.SharedMemory(name=ideal_name)
+    try:
+        train_values = np.ndarray(train_shape, dtype=dtype, buffer=train_shm.buf)
+        ideal_values = np.ndarray(ideal_shape, dtype=dtype, buffer=ideal_shm.buf)[:, start:stop]
+        idx, exact = top_k_candidates(train_values, ideal_values, k, block_size)
+        del train_values, ideal_values
+    finally:
+        train_shm.close()
+        ideal_shm.close()
+    return idx + start, exact
+
+def parallel_top_k(train_values, ideal_values, k, workers, block_size=4096):
+    """
+    Shard the ideal columns across a process pool and merge each shard's top-k.
+    The arrays are copied once into shared memory and workers attach to them by name,
+    so nothing but the shard bounds and results is pickled. Set OMP/MKL/OPENBLAS thread
+    counts to 1 in the environment to avoid oversubscribing cores with BLAS threads.
+
+    Args::
+    train_values (np.ndarray): (rows, n_train) training values.
+    ideal_values (np.ndarray): (rows, n_ideal) ideal function values.
+    k (int): candidates per training column.
+    workers (int): number of processes / shards.
+    block_size (int): ideal columns per matrix product inside a worker.
+
+    Returns:
+    tuple: (n_train, k) ideal column indices and exact SSE, same as top_k_candidates()
+    """
+    n_ideal = ideal_values.shape[1]
+    dtype = np.result_type(train_values, ideal_values)
+    bounds = np.linspace(0, n_ideal, min(workers, n_ideal) + 1).astype(int)
+
+    shms = []
+    try:
+        names = []
+        for values in (train_values, ideal_values):
+            shm = shared_memory.SharedMemory(create=True, size=max(values.shape[0] * values.shape[1] * dtype.itemsize, 1))
+            shms.append(shm)
+            np.ndarray(values.shape, dtype=dtype, buffer=shm.buf)[...] = values
+            names.append(shm.name)
+
+        specs = [(names[0], names[1], train_values.shape, ideal_values.shape, dtype.str, start, stop, k, block_size)
+                 for start, stop in zip(bounds[:-1], bounds[1:])]
+        with Pool(processes=len(specs)) as pool:
+            results = pool.map(sse_shard, specs)
+    finally:
+        for shm in shms:
+            shm.close()
+            shm.unlink()
+
+    all_idx = np.concatenate([r[0] for r in results], axis=1)
+    all_exact = np.concatenate([r[1] for r in results], axis=1)
+    k = min(k, n_ideal)
+    idx = np.empty((all_idx.shape[0], k), dtype=np.intp)
+    exact = np.empty((all_idx.shape[0], k))
+    for i in range(all_idx.shape[0]):
+        order = np.lexsort((all_idx[i], all_exact[i]))[:k]
+        idx[i] = all_idx[i, order]
+        exact[i] = all_exact[i, order]
+    return idx, exact
+
+
+class AnnIndex():
+    """
+    Approximate nearest-function index over the ideal columns. Each column is reduced to
+    dim values with PCA (eigenvectors of the row Gram matrix) or a Gaussian random projection;
+    squared distances in that space approximate the SSE and are used to shortlist candidates,
+    which the Trainer then re-ranks by exact SSE.
+    """
+    def __init__(self, projection, projected, columns, fingerprint, method):
+        """
+        Args::
+        projection (np.ndarray): (rows, dim) projection matrix.
+        projected (np.ndarray): (dim, n_ideal) projected ideal columns.
+        columns (list): ideal column names, in projected order.
+        fingerprint (str): identity of the data the index was built from, see data_fingerprint().
+        method (str): "pca" or "random".
+        """
+        self.projection = projection
+        self.projected = projected
+        self.columns = list(columns)
+        self.fingerprint = fingerprint
+        self.method = method
+
+    @staticmethod
+    def data_fingerprint(x_values, columns, content=""):
+        """
+        Identity of an ideal table: its x values, column names and a content token, see content_token()
+        """
+        digest = hashlib.sha1(np.ascontiguousarray(x_values, dtype=np.float64).tobytes())
+        digest.update("\0".join(columns).encode())
+        digest.update(b"\0" + content.encode())
+        return digest.hexdigest()
+
+    @staticmethod
+    def content_token(db_connector, table_name):
+        """
+        Identity of the values of table_name: the table checksum recorded by ingest, so a re-ingest
+        invalidates the index without reading the table; tables loaded without checksums are
+        hashed row by row. SQL edits after ingest bypass the checksum; rebuild explicitly after those.
+        """
+        checksum = source_checksum(db_connector.conn, table_name)
+        return checksum if checksum is not None else table_fingerprint(db_connector.conn, [table_name])
+
+    @classmethod
+    def build(cls, ideal_values, columns, x_values, dim=32, method="pca", seed=0, block_size=4096, content=""):
+        """
+        Build the index from the ideal values
+
+        Args::
+        ideal_values (np.ndarray): (rows, n_ideal) ideal function values.
+        columns (list): ideal column names.
+        x_values (np.ndarray): x column, used for the fingerprint.
+        dim (int): reduced dimension. Defaults to 32.
+        method (str): "pca" or "random". Defaults to "pca".
+        seed (int): random projection seed. Defaults to 0.
+        block_size (int): ideal columns per block while building. Defaults to 4096.
+        content (str): content token for the fingerprint, see content_token(). Defaults to "".
+
+        Returns:
+        AnnIndex: the new index
+        """
+        n_rows = ideal_values.shape[0]
+        dim = min(dim, n_rows)
+        if method == "pca":
+            # Gram matrix of the rows is (rows, rows), so this stays cheap for millions of columns
+            gram = np.zeros((n_rows, n_rows))
+            for start in range(0, ideal_values.shape[1], block_size):
+                block = ideal_values[:, start:start + block_size]
+                gram += block @ block.T
+            _, eigvecs = np.linalg.eigh(gram)
+            projection = eigvecs[:, ::-1][:, :dim].copy()
+        elif method == "random":
+            projection = np.random.default_rng(seed).standard_normal((n_rows, dim)) / np.sqrt(dim)
+        else:
+            raise ValueError(f"unknown ANN method {method}")
+
+        projected = np.empty((dim, ideal_values.shape[1]))
+        for start in range(0, ideal_values.shape[1], block_size):
+            projected[:, start:start + block_size] = projection.T @ ideal_values[:, start:start + block_size]
+        return cls(projection, projected, columns, cls.data_fingerprint(x_values, columns, content), method)
+
+    @staticmethod
+    def default_path(db_connector):
+        """
+        Index file next to the database: functions.db -> functions.ann.npz
+        """
+        return os.path.splitext(SQLiteStorage(db_connector.conn).db_file)[0] + ".ann.npz"
+
+    def save(self, path):
+        np.savez(path, projection=self.projection, projected=self.projected, columns=np.array(self.columns),
+                 fingerprint=np.array(self.fingerprint), method=np.array(self.method))
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(data["projection"], data["projected"], data["columns"].tolist(), str(data["fingerprint"]), str(data["method"]))
+
+    @classmethod
+    def load_or_build(cls, db_connector, function_loader, columns=None, path=None, rebuild=False, **build_args):
+        """
+        Load the persisted index if it matches the ideal table, otherwise build and save it
+
+        Args::
+        db_connector: Database connection instance.
+        function_loader: Data loader for ideal functions.
+        columns (list, optional): ideal columns to index. Defaults to every column except x.
+        path (str, optional): index file. Defaults to default_path().
+        rebuild (bool): ignore a persisted index. Defaults to False.
+
+        Returns:
+        AnnIndex: the loaded or new index
+        """
+        columns = columns if columns is not None else [c for c in function_loader.columns if c != "x"]
+        path = path or cls.default_path(db_connector)
+        x_values = function_loader.column("x").to_numpy()
+        content = cls.content_token(db_connector, function_loader.table_name)
+        if not rebuild and os.path.exists(path):
+            index = cls.load(path)
+            if index.fingerprint == cls.data_fingerprint(x_values, columns, content):
+                return index
+            print("ANN index is stale, rebuilding")
+
+        index = cls.build(function_loader.get_columns(columns).to_numpy(dtype=np.float64), columns, x_values, content=content, **build_args)
+        index.save(path)
+        return index
+
+    def shortlist(self, train_values, size):
+        """
+        Candidate ideal column indices for each training column
+
+        Args::
+        train_values (np.ndarray): (rows, n_train) training values.
+        size (int): shortlist length per training column.
+
+        Returns:
+        np.ndarray: (n_train, size) column indices
+        """
+        distances = sse_matrix(self.projection.T @ train_values, self.projected)
+        size = min(size, distances.shape[1])
+        if size == distances.shape[1]:
+            return np.tile(np.arange(size), (distances.shape[0], 1))
+        return np.argpartition(distances, size - 1, axis=1)[:, :size]
 
 class Trainer():
     """
     Trainer class for finding the best matching ideal functions for training data
     """
-    def __init__(self, db_connector, train_loader, function_loader):
+    def __init__(self, db_connector, train_loader, function_loader, train_columns=None, ideal_columns=None, block_size=4096, workers=1,
+                 ann_index=None, shortlist_size=64):
         """
         Initialize the Trainer with database connector and data loaders
 
@@ -15,11 +333,125 @@ class Trainer():
         db_connector: Database connection instance.
         train_loader: Data loader for training data.
         function_loader: Data loader for ideal functions.
+        train_columns (list, optional): training columns to match. Defaults to every column except x.
+        ideal_columns (list, optional): candidate ideal columns. Defaults to every column except x.
+        block_size (int, optional): number of ideal columns per matrix product. Defaults to 4096.
+        workers (int, optional): processes to shard the ideal columns across. Defaults to 1.
+        ann_index (AnnIndex, optional): shortlist candidates with this index and re-rank them exactly
+            instead of scoring every ideal column. Defaults to None.
+        shortlist_size (int, optional): ANN candidates per training column. Defaults to 64.
         """       
         self.db = db_connector
         self.train_loader = train_loader
         self.function_loader = function_loader
-        
+        self.train_columns = train_columns if train_columns is not None else [c for c in train_loader.columns if c != "x"]
+        self.ideal_columns = ideal_columns if ideal_columns is not None else [c for c in function_loader.columns if c != "x"]
+        self.block_size = block_size
+        self.workers = workers
+        self.ann_index = ann_index
+        self.shortlist_size = shortlist_size
+        if ann_index is not None:
+            self.ideal_columns = ann_index.columns
+
+    def compute_sse_matrix(self):
+        """
+        Compute the SSE of every (train column, ideal column) pair in one batched computation
+
+        Returns:
+        np.ndarray: SSE matrix of shape (len(train_columns), len(ideal_columns))
+        """
+        train_values = self.train_loader.array(self.train_columns)
+        ideal_values = self.function_loader.array(self.ideal_columns)
+        return sse_matrix(train_values, ideal_values, self.block_size)
+
+    def exact_sse(self, y_train_col, y_ideal_cols):
+        """
+        Compute the SSE of one training column against a few ideal columns by direct differences,
+        skipping missing values
+
+        Args::
+        y_train_col (str): training column name.
+        y_ideal_cols (list): ideal column names.
+
+        Returns:
+        np.ndarray: SSE for each ideal column
+        """
+        train_values = self.train_loader.array([y_train_col]).astype(np.float64)
+        ideal_values = self.function_loader.array(y_ideal_cols)
+        return np.nansum((ideal_values - train_values) ** 2, axis=0)
+
+    def train_top_k(self, k=1):
+        """
+        Find the k best matching ideal functions for each training dataset column.
+        The batched SSE matrix prunes the candidates and every column within its rounding
+        error bound of the k-th best is re-scored with exact differences, so the result and
+        its tie order match a direct loop over the columns.
+        With workers > 1 the ideal columns are sharded across a process pool.
+
+        Args::
+        k (int): number of candidates to keep per training column.
+
+        Returns:
+        dict: training column -> list of (ideal column, SSE) sorted by ascending SSE
+        """
+        if self.ann_index is not None:
+            return self.train_top_k_ann(k)
+
+        # views of the loaders' arrays in compact mode, float64 copies otherwise
+        train_values = self.train_loader.array(self.train_columns)
+        ideal_values = self.function_loader.array(self.ideal_columns)
+        if self.workers > 1:
+            idx, exact = parallel_top_k(train_values, ideal_values, k, self.workers, self.block_size)
+        else:
+            idx, exact = top_k_candidates(train_values, ideal_values, k, self.block_size)
+
+        return {y_train_col: [(self.ideal_columns[j], float(e)) for j, e in zip(idx[i], exact[i])]
+                for i, y_train_col in enumerate(self.train_columns)}
+
+    def train_top_k_ann(self, k=1):
+        """
+        ANN path of train_top_k(): shortlist with the index, then re-rank the shortlist by exact SSE.
+        With a lazy function_loader only the shortlisted ideal columns are fetched.
+
+        Args::
+        k (int): number of candidates to keep per training column.
+
+        Returns:
+        dict: training column -> list of (ideal column, SSE) sorted by ascending SSE
+        """
+        train_values = self.train_loader.array(self.train_columns).astype(np.float64)
+        shortlist = self.ann_index.shortlist(train_values, max(k, self.shortlist_size))
+
+        top_k = {}
+        for i, y_train_col in enumerate(self.train_columns):
+            cols = np.sort(shortlist[i])
+            exact = self.exact_sse(y_train_col, [self.ideal_columns[j] for j in cols])
+            order = np.argsort(exact, kind="stable")[:k]
+            top_k[y_train_col] = [(self.ideal_columns[cols[j]], float(exact[j])) for j in order]
+        return top_k
+
+    def evaluate_recall(self, k=1):
+        """
+        Recall@k of the ANN path against the exact path: the fraction of exact top-k
+        candidates that the ANN path also returns. This runs the full exact search.
+
+        Args::
+        k (int): candidates per training column. Defaults to 1.
+
+        Returns:
+        float: recall@k
+        """
+        ann_index, self.ann_index = self.ann_index, None
+        try:
+            exact = self.train_top_k(k)
+        finally:
+            self.ann_index = ann_index
+        approx = self.train_top_k_ann(k)
+
+        hits = sum(len({c for c, _ in exact[col]} & {c for c, _ in approx[col]}) for col in self.train_columns)
+        recall = hits / sum(len(exact[col]) for col in self.train_columns)
+        print(f"ANN recall@{k} against the exact search: {recall:.4f}")
+        return recall
 
     def train(self,):
         """
@@ -30,71 +462,385 @@ class Trainer():
         """
         best_functions = {}
 
-        for y_train_col in ["y1", "y2", "y3", "y4"]:
-            min_sse = float('inf')  
-            best_function = None
+        with metrics.stage("trainer.train", trainer=type(self).__name__, candidates=len(self.ideal_columns)) as record:
+            for y_train_col, candidates in self.train_top_k(k=1).items():
+                best_function, min_sse = candidates[0]
+                best_functions[y_train_col] = best_function
+                print(f"Training function: {y_train_col} the best matched function is {best_function}, SSE = {min_sse:.6f}")
+            record["rows"] = self.row_count()
+        return best_functions
 
-            for y_ideal_col in [f"y{i+1}" for i in range(50)]:
-                sse = np.sum((self.train_loader.df[y_train_col] - self.function_loader.df[y_ideal_col]) ** 2)
+    def row_count(self):
+        """
+        Number of training rows the last training run processed, for the metrics
+        """
+        return len(self.train_loader.column("x"))
 
-                if sse < min_sse:
-                    min_sse = sse
-                    best_function = y_ideal_col
+    def max_deviation(self, best_functions):
+        """
+        Compute the maximum absolute deviation between each training column and its matched ideal function
 
-            best_functions[y_train_col] = best_function
-            print(f"Training function: {y_train_col} the best matched function is {best_function}, SSE = {min_sse:.6f}")
-        return best_functions
+        Args::
+        best_functions (dict): Dictionary mapping training functions to ideal functions.
 
-    def dump_ideal(self, best_functions):
+        Returns:
+        dict: training function -> max |y_train - y_ideal|
+        """
+        return {train_func: column_max_deviation(self.train_loader, self.function_loader, train_func, ideal_func)
+                for train_func, ideal_func in best_functions.items()}
+
+    def dump_ideal(self, best_functions, max_deviation=None):
         """
         Save the best function mappings into the database
 
         Args:
         best_functions (dict): Dictionary mapping training functions to ideal functions.
+        max_deviation (dict, optional): training function -> max deviation, stored so the Tester
+            does not have to recompute it. Defaults to None (column left NULL).
         """
         self.db.cursor.execute("""
         CREATE TABLE IF NOT EXISTS best_function_mapping (
             train_function TEXT PRIMARY KEY,
-            ideal_function TEXT
+            ideal_function TEXT,
+            max_deviation REAL
         );
         """)
+        existing = [row[1] for row in self.db.cursor.execute("PRAGMA table_info(best_function_mapping)")]
+        if "max_deviation" not in existing:
+            self.db.cursor.execute("ALTER TABLE best_function_mapping ADD COLUMN max_deviation REAL")
 
         self.db.cursor.execute("DELETE FROM best_function_mapping")
 
+        max_deviation = max_deviation or {}
         for train_func, ideal_func in best_functions.items():
-            self.db.cursor.execute("INSERT INTO best_function_mapping (train_function, ideal_function) VALUES (?, ?)", (train_func, ideal_func))
+            self.db.cursor.execute("INSERT INTO best_function_mapping (train_function, ideal_function, max_deviation) VALUES (?, ?, ?)",
+                                   (train_func, ideal_func, max_deviation.get(train_func)))
 
+        # the connection belongs to the DBConnector and stays open for its other users
         self.db.conn.commit()
-        self.db.conn.close()
 
         print("Best matched funcs save in dataset！")
 
-def main():
+class StreamingTrainer(Trainer):
+    """
+    Out-of-core trainer: streams train and ideal rows joined on x in x-ordered chunks and
+    accumulates SSE and max |dy| for every (train, ideal) pair in the same pass, so neither
+    table has to fit in memory and the thresholds come for free.
+    """
+    def __init__(self, db_connector, train_table="train_data", ideal_table="ideal_functions",
+                 train_columns=None, ideal_columns=None, chunksize=100000, block_size=256):
+        """
+        Args::
+        db_connector: Database connection instance.
+        train_table (str): training table. Defaults to "train_data".
+        ideal_table (str): ideal function table. Defaults to "ideal_functions".
+        train_columns (list, optional): training columns to match. Defaults to every column except x.
+        ideal_columns (list, optional): candidate ideal columns. Defaults to every column except x.
+        chunksize (int): rows fetched per chunk. Defaults to 100000.
+        block_size (int): ideal columns per difference block; peak memory is about
+            chunksize * len(train_columns) * block_size * 8 bytes. Defaults to 256.
+        """
+        self.db = db_connector
+        self.train_table = train_table
+        self.ideal_table = ideal_table
+        self.train_columns = train_columns if train_columns is not None else [c for c in SQLiteStorage(db_connector.conn).table_columns(train_table) if c != "x"]
+        self.ideal_columns = ideal_columns if ideal_columns is not None else [c for c in SQLiteStorage(db_connector.conn).table_columns(ideal_table) if c != "x"]
+        self.chunksize = chunksize
+        self.block_size = block_size
+        self.sse = None
+        self.max_dev = None
+        self.rows = 0
+
+    def stream_rows(self, join="", where=""):
+        """
+        Cursor over the x-ordered join of train and ideal rows: x, train columns, ideal columns
+
+        Args::
+        join (str): extra JOIN clause. Defaults to "".
+        where (str): WHERE condition. Defaults to "".
+        """
+        select = ", ".join(["t.x"] + [f't."{c}"' for c in self.train_columns] + [f'i."{c}"' for c in self.ideal_columns])
+        return self.db.conn.execute(
+            f"SELECT {select} FROM {self.train_table} t JOIN {self.ideal_table} i ON i.x = t.x {join} "
+            + (f"WHERE {where} " if where else "") + "ORDER BY t.x")
+
+    def accumulate_chunk(self, block, sse, max_dev):
+        """
+        Add one chunk of joined rows to the running SSE and max deviation matrices, in place
+
+        Args::
+        block (np.ndarray): (rows, 1 + n_train + n_ideal) chunk from stream_rows().
+        sse (np.ndarray): running SSE matrix.
+        max_dev (np.ndarray): running max deviation matrix.
+        """
+        n_train = len(self.train_columns)
+        train_values = block[:, 1:1 + n_train]
+        for start in range(0, len(self.ideal_columns), self.block_size):
+            ideal_values = block[:, 1 + n_train + start:1 + n_train + start + self.block_size]
+            diff = np.abs(train_values[:, :, None] - ideal_values[:, None, :])
+            stop = start + ideal_values.shape[1]
+            # missing values are skipped, as in Trainer: nansum for the SSE and fmax, which ignores NaN, for the max
+            sse[:, start:stop] += np.nansum(diff ** 2, axis=0)
+            np.fmax(max_dev[:, start:stop], np.fmax.reduce(diff, axis=0), out=max_dev[:, start:stop])
+
+    def accumulate(self):
+        """
+        Run the single streaming pass
+
+        Returns:
+        tuple: SSE matrix and max deviation matrix, both (len(train_columns), len(ideal_columns))
+        """
+        cursor = self.stream_rows()
+        sse = np.zeros((len(self.train_columns), len(self.ideal_columns)))
+        max_dev = np.zeros((len(self.train_columns), len(self.ideal_columns)))
+        self.rows = 0
+        while True:
+            rows = cursor.fetchmany(self.chunksize)
+            if not rows:
+                break
+            self.accumulate_chunk(np.array(rows, dtype=np.float64), sse, max_dev)
+            self.rows += len(rows)
+
+        self.sse = sse
+        self.max_dev = max_dev
+        return sse, max_dev
+
+    def train_top_k(self, k=1):
+        """
+        Find the k best matching ideal functions for each training column from the streamed SSE
+
+        Args::
+        k (int): number of candidates to keep per training column.
+
+        Returns:
+        dict: training column -> list of (ideal column, SSE) sorted by ascending SSE
+        """
+        if self.sse is None:
+            self.accumulate()
+        order = np.argsort(self.sse, axis=1, kind="stable")[:, :k]
+        return {y_train_col: [(self.ideal_columns[j], float(self.sse[i, j])) for j in order[i]]
+                for i, y_train_col in enumerate(self.train_columns)}
+
+    def row_count(self):
+        return self.rows
+
+    def max_deviation(self, best_functions):
+        """
+        Look up the max deviation of each chosen pair, accumulated during the pass
+
+        Args::
+        best_functions (dict): Dictionary mapping training functions to ideal functions.
+
+        Returns:
+        dict: training function -> max |y_train - y_ideal|
+        """
+        if self.max_dev is None:
+            self.accumulate()
+        return {train_func: float(self.max_dev[self.train_columns.index(train_func), self.ideal_columns.index(ideal_func)])
+                for train_func, ideal_func in best_functions.items()}
+
+class IncrementalTrainer(StreamingTrainer):
+    """
+    Streaming trainer that persists its sufficient statistics (per-pair SSE, max |dy| and row
+    count in training_stats, processed x values in training_seen_x), so a retrain only streams
+    train rows whose x has not been processed yet. Meant for append-only feeds. The statistics
+    start over when the ideal table changed or the train table was re-ingested, which the
+    tokens in training_sources tell; rows edited in place without ingest are not detected,
+    pass reset=True after those.
+    """
+    def __init__(self, db_connector, reset=False, **kwargs):
+        """
+        Args::
+        db_connector: Database connection instance.
+        reset (bool): discard the persisted statistics and start from scratch. Defaults to False.
+        kwargs: passed to StreamingTrainer.
+        """
+        super().__init__(db_connector, **kwargs)
+        self.reset = reset
+        self.new_rows = 0
+        self.sources = None
+
+    def source_tokens(self):
+        """
+        Tokens of the tables the persisted statistics were computed from: any change of the ideal
+        table, and the ingest checksum of the train table, which appended rows leave alone but
+        a re-ingest replaces (None for train tables loaded without checksums)
+
+        Returns:
+        dict: table name -> token
+        """
+        return {self.ideal_table: table_token(self.db.conn, self.ideal_table),
+                self.train_table: source_checksum(self.db.conn, self.train_table)}
+
+    def load_stats(self):
+        """
+        Read the persisted statistics into matrices; start over when they don't cover exactly
+        the current (train, ideal) columns or were computed from other table contents
+
+        Returns:
+        tuple: SSE matrix, max deviation matrix and row count
+        """
+        cursor = self.db.conn.cursor()
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS training_stats (
+            train_function TEXT,
+            ideal_function TEXT,
+            sse REAL,
+            max_deviation REAL,
+            rows INTEGER,
+            PRIMARY KEY (train_function, ideal_function)
+        );
+        """)
+        cursor.execute("CREATE TABLE IF NOT EXISTS training_seen_x (x REAL PRIMARY KEY)")
+        cursor.execute("CREATE TABLE IF NOT EXISTS training_sources (table_name TEXT PRIMARY KEY, token TEXT)")
+        self.sources = self.source_tokens()
+        stored_sources = dict(cursor.execute("SELECT table_name, token FROM training_sources").fetchall())
+
+        sse = np.zeros((len(self.train_columns), len(self.ideal_columns)))
+        max_dev = np.zeros_like(sse)
+        stats = cursor.execute("SELECT train_function, ideal_function, sse, max_deviation, rows FROM training_stats").fetchall()
+
+        train_pos = {c: i for i, c in enumerate(self.train_columns)}
+        ideal_pos = {c: j for j, c in enumerate(self.ideal_columns)}
+        covered = len(stats) == sse.size and all(t in train_pos and i in ideal_pos for t, i, _, _, _ in stats)
+        if self.reset or not covered or stored_sources != self.sources:
+            cursor.execute("DELETE FROM training_stats")
+            cursor.execute("DELETE FROM training_seen_x")
+            cursor.execute("DELETE FROM training_sources")
+            self.db.conn.commit()
+            return sse, max_dev, 0
+
+        for train_func, ideal_func, pair_sse, pair_max, rows in stats:
+            sse[train_pos[train_func], ideal_pos[ideal_func]] = pair_sse
+            max_dev[train_pos[train_func], ideal_pos[ideal_func]] = pair_max
+        return sse, max_dev, stats[0][4] if stats else 0
+
+    def accumulate(self):
+        """
+        Stream only the unseen rows on top of the persisted statistics, then persist the new
+        statistics and seen x values in one transaction
+
+        Returns:
+        tuple: SSE matrix and max deviation matrix, both (len(train_columns), len(ideal_columns))
+        """
+        sse, max_dev, rows = self.load_stats()
+        cursor = self.db.conn.cursor()
+        cursor.execute("CREATE TEMP TABLE IF NOT EXISTS training_new_x (x REAL)")
+        cursor.execute("DELETE FROM temp.training_new_x")
+
+        # the anti-join is an index probe per row inside SQLite; only unseen rows reach Python
+        rows_cursor = self.stream_rows(join="LEFT JOIN training_seen_x s ON s.x = t.x", where="s.x IS NULL")
+        self.new_rows = 0
+        while True:
+            chunk = rows_cursor.fetchmany(self.chunksize)
+            if not chunk:
+                break
+            block = np.array(chunk, dtype=np.float64)
+            self.accumulate_chunk(block, sse, max_dev)
+            cursor.executemany("INSERT INTO temp.training_new_x (x) VALUES (?)", [(x,) for x in block[:, 0].tolist()])
+            self.new_rows += len(chunk)
+
+        rows += self.new_rows
+        cursor.execute("INSERT OR IGNORE INTO training_seen_x (x) SELECT x FROM temp.training_new_x")
+        cursor.executemany(
+            "INSERT OR REPLACE INTO training_stats (train_function, ideal_function, sse, max_deviation, rows) VALUES (?, ?, ?, ?, ?)",
+            [(t, i, float(sse[a, b]), float(max_dev[a, b]), rows)
+             for a, t in enumerate(self.train_columns) for b, i in enumerate(self.ideal_columns)])
+        cursor.executemany("INSERT OR REPLACE INTO training_sources (table_name, token) VALUES (?, ?)", list(self.sources.items()))
+        self.db.conn.commit()
+        print(f"Incremental training: {self.new_rows} new rows, {rows} rows in total")
+
+        self.rows = rows
+        self.sse = sse
+        self.max_dev = max_dev
+        return sse, max_dev
+
+def benchmark_sharded_training(n_rows=400, n_ideal=200000, n_train=4, worker_counts=None, k=1):
+    """
+    Scaling benchmark for parallel_top_k on synthetic data
+
+    Args::
+    n_rows (int): rows per column. Defaults to 400.
+    n_ideal (int): number of candidate ideal columns. Defaults to 200000.
+    n_train (int): number of training columns. Defaults to 4.
+    worker_counts (list, optional): worker counts to time. Defaults to powers of two up to os.cpu_count().
+    k (int): candidates per training column. Defaults to 1.
+
+    Returns:
+    dict: workers -> (seconds, speedup over the first worker count)
+    """
+    print("===============sharded training benchmark================")
+    if worker_counts is None:
+        worker_counts = [w for w in (1, 2, 4, 8, 16, 32, 64) if w <= (os.cpu_count() or 1)]
+    rng = np.random.default_rng(0)
+    ideal_values = rng.standard_normal((n_rows, n_ideal))
+    train_values = ideal_values[:, rng.choice(n_ideal, n_train, replace=False)] + 0.1 * rng.standard_normal((n_rows, n_train))
+
+    results = {}
+    reference = None
+    reference_idx = None
+    for workers in worker_counts:
+        start = time.perf_counter()
+        if workers > 1:
+            idx, _ = parallel_top_k(train_values, ideal_values, k, workers)
+        else:
+            idx, _ = top_k_candidates(train_values, ideal_values, k)
+        elapsed = time.perf_counter() - start
+        reference = reference if reference is not None else elapsed
+        reference_idx = reference_idx if reference_idx is not None else idx
+        results[workers] = (elapsed, reference / elapsed)
+        print(f"workers = {workers:3d}: {elapsed:.3f}s, speedup = {reference / elapsed:.2f}x"
+              + ("" if np.array_equal(idx, reference_idx) else ", DIFFERENT candidates"))
+    print("=========================================================")
+    return results
+
+def main(db_path=DEFAULT_DB_PATH, stream=False, chunksize=100000, workers=1, ann=False, check_recall=False, incremental=False, dtype=None,
+         store_dir=DEFAULT_STORE_DIR):
     """
     Main function to execute the training process
+
+    Args::
+    db_path (str): database file. Defaults to DEFAULT_DB_PATH.
+    stream (bool): use the out-of-core StreamingTrainer. Defaults to False.
+    chunksize (int): rows per chunk in streaming mode. Defaults to 100000.
+    workers (int): processes for sharded training in in-memory mode. Defaults to 1.
+    ann (bool): shortlist with the persisted AnnIndex and re-rank exactly. Defaults to False.
+    check_recall (bool): report ANN recall@1 against the exact search. Defaults to False.
+    incremental (bool): use the IncrementalTrainer and only process new train rows. Defaults to False.
+    dtype (optional): np.float32 or np.float64 to load the in-memory tables in compact mode. Defaults to None.
+    store_dir (str, optional): column store the loaders read from. Defaults to DEFAULT_STORE_DIR ($PIPELINE_STORE).
     """
     print("================performing training=================")
-    db_connector =DBConnector(db_path="/Users/lincong/Desktop/python_course/assignment/Dataset/functions.db")
-    train_loader = TrainDataloader(db_connector)
-    function_loader =FunctionDataloader(db_connector)
+    db_connector =DBConnector(db_path=db_path, store_dir=store_dir)
+    if incremental:
+        trainer = IncrementalTrainer(db_connector, chunksize=chunksize)
+    elif stream:
+        trainer = StreamingTrainer(db_connector, chunksize=chunksize)
+    else:
+        train_loader = TrainDataloader(db_connector, dtype=dtype)
+        function_loader =FunctionDataloader(db_connector, lazy=ann, dtype=dtype)
+        ann_index = AnnIndex.load_or_build(db_connector, function_loader) if ann else None
+        trainer = Trainer(db_connector, train_loader, function_loader, workers=workers, ann_index=ann_index)
+        if ann and check_recall:
+            trainer.evaluate_recall()
 
-    trainer = Trainer(db_connector, train_loader, function_loader)
     best_functions = trainer.train()
-    trainer.dump_ideal(best_functions)
+    trainer.dump_ideal(best_functions, trainer.max_deviation(best_functions))
+    db_connector.close()
 
-def train_unit_test():
+def train_unit_test(db_path=DEFAULT_DB_PATH, store_dir=DEFAULT_STORE_DIR):
     """
     Perform a unit test to validate the training function
     """
     print("===============performing unit test================")
-    db_connector =DBConnector(db_path="/Users/lincong/Desktop/python_course/assignment/Dataset/functions.db")
+    db_connector =DBConnector(db_path=db_path, store_dir=store_dir)
     fake_train_loader = FunctionDataloader(db_connector)
     function_loader =FunctionDataloader(db_connector)
     
     expected_func = {'y1': 'y1', 'y2': 'y2', 'y3': 'y3', 'y4': 'y4'}
 
     
-    trainer = Trainer(db_connector, fake_train_loader, function_loader)
+    trainer = Trainer(db_connector, fake_train_loader, function_loader, train_columns=list(expected_func.keys()))
     best_functions = trainer.train()
 
     sanity_check = True
@@ -103,6 +849,8 @@ def train_unit_test():
             sanity_check = False
             break
 
+    db_connector.close()
+    sanity_check = sanity_check and offset_unit_test()
     if sanity_check:
         print("unit test passed!")
     else:
@@ -110,7 +858,51 @@ def train_unit_test():
         exit(0)
     print("====================================================")
 
+def offset_unit_test(cases=20, n_rows=200, n_ideal=40, n_train=4, seed=0):
+    """
+    Compare Trainer.train() with a direct-difference loop on columns sharing an offset of 1e4
+    that differ by about 1e-4 per row, with some ideal columns duplicated at later positions and
+    a missing value in one ideal and one training column. The loop keeps the first strict
+    minimum and skips missing values like the pandas sum, so a tie must go to the earlier column.
+
+    Returns:
+    bool: True if every case picks the same functions as the loop
+    """
+    rng = np.random.default_rng(seed)
+    db_connector = DBConnector(db_path=":memory:")
+    x = np.linspace(-20, 20, n_rows)
+    ideal_names = [f"y{j + 1}" for j in range(n_ideal)]
+    train_names = [f"y{j + 1}" for j in range(n_train)]
+    mismatches = 0
+    for _ in range(cases):
+        ideal_values = 1e4 + np.sin(x)[:, None] + 1e-4 * rng.standard_normal((n_rows, n_ideal))
+        sources = rng.choice(n_ideal // 2, n_ideal // 4, replace=False)
+        ideal_values[:, n_ideal - len(sources):] = ideal_values[:, sources]
+        picks = rng.choice(n_ideal, n_train)
+        train_values = ideal_values[:, picks] + 1e-4 * rng.standard_normal((n_rows, n_train))
+        ideal_values[rng.integers(n_rows), rng.integers(n_ideal)] = np.nan
+        train_values[rng.integers(n_rows), rng.integers(n_train)] = np.nan
+
+        pd.DataFrame({"x": x, **dict(zip(ideal_names, ideal_values.T))}).to_sql("unit_ideal", db_connector.conn, if_exists="replace", index=False)
+        pd.DataFrame({"x": x, **dict(zip(train_names, train_values.T))}).to_sql("unit_train", db_connector.conn, if_exists="replace", index=False)
+        trainer = Trainer(db_connector, Dataloader(db_connector, "unit_train"), Dataloader(db_connector, "unit_ideal"))
+        with contextlib.redirect_stdout(io.StringIO()):
+            best_functions = trainer.train()
+
+        for j, train_col in enumerate(train_names):
+            best, min_sse = None, np.inf
+            for k, ideal_col in enumerate(ideal_names):
+                sse = np.nansum((ideal_values[:, k] - train_values[:, j]) ** 2)
+                if sse < min_sse:
+                    best, min_sse = ideal_col, sse
+            mismatches += best_functions[train_col] != best
+
+    db_connector.close()
+    print(f"offset data: {mismatches} of {cases * n_train} picks differ from the direct loop")
+    return mismatches == 0
+
 
-train_unit_test()
+if __name__ == "__main__":
+    train_unit_test()
 
-main()
\ No newline at end of file
+    main()
@@ -1,24 +1,99 @@
 import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
 from loader import *
-from test import *
-from train import *
+from test import Tester
+
+
+class RunningStats:
+    """
+    Count, mean, min, max and sum of squared deviations over values seen in chunks, merged with the
+    parallel form of Welford's algorithm (Chan et al.), so memory does not grow with the data.
+    """
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = np.inf
+        self.max = -np.inf
+
+    def update(self, values):
+        """
+        Fold a chunk of values in.
+
+        Parameters:
+        values (np.ndarray): chunk of values.
+        """
+        values = np.asarray(values, dtype=np.float64)
+        if len(values) == 0:
+            return
+        chunk_mean = values.mean()
+        self.merge(len(values), chunk_mean, float(((values - chunk_mean) ** 2).sum()), values.min(), values.max())
+
+    def merge(self, count, mean, m2, minimum, maximum):
+        total = self.count + count
+        delta = mean - self.mean
+        self.mean += delta * count / total
+        self.m2 += m2 + delta ** 2 * self.count * count / total
+        self.count = total
+        self.min = min(self.min, float(minimum))
+        self.max = max(self.max, float(maximum))
+
+    def result(self):
+        """
+        Returns:
+        dict: mean_error, max_error, std_dev (population, like np.std) and matched_points
+        """
+        if self.count == 0:
+            return {"mean_error": np.nan, "max_error": np.nan, "std_dev": np.nan, "matched_points": 0}
+        return {"mean_error": self.mean, "max_error": self.max, "std_dev": np.sqrt(self.m2 / self.count),
+                "matched_points": self.count}
 
 
 class ErrorAnalyzer:
     """
     Class for analyzing errors in test data matching.
+
+    Works on an in-memory DataFrame, or directly on the test_mapping table of a database: then
+    the statistics are SQLite aggregates ("sql") or one streaming pass ("stream"), and nothing
+    larger than a chunk is ever held in memory.
     """
-    def __init__(self, test_mapping_df):
+    def __init__(self, test_mapping_df=None, db_connector=None, table_name="test_mapping", method="sql", chunksize=100000):
         """
-        Initialize the ErrorAnalyzer with the test mapping DataFrame.
+        Initialize the ErrorAnalyzer with the test mapping DataFrame or a database.
 
         Parameters:
-        test_mapping_df (DataFrame): DataFrame containing test data and their corresponding matches.
+        test_mapping_df (DataFrame, optional): DataFrame containing test data and their corresponding matches.
+        db_connector (DBConnector, optional): database holding table_name; used when no DataFrame is given.
+        table_name (str): table with the matches. Defaults to "test_mapping".
+        method (str): "sql" for aggregate queries or "stream" for a chunked Welford pass. Defaults to "sql".
+        chunksize (int): rows per chunk when streaming and exporting. Defaults to 100000.
         """
+        if test_mapping_df is None and db_connector is None:
+            raise ValueError("ErrorAnalyzer needs a DataFrame or a db_connector")
+        if method not in ("sql", "stream"):
+            raise ValueError(f"unknown method {method!r}, expected 'sql' or 'stream'")
         self.test_mapping_df = test_mapping_df
+        self.db = db_connector
+        self.table_name = table_name
+        self.method = method
+        self.chunksize = chunksize
+
+    def iter_chunks(self, columns="*"):
+        """
+        Yield the matches in rowid order, chunksize rows at a time.
+        """
+        if self.test_mapping_df is not None:
+            for start in range(0, len(self.test_mapping_df), self.chunksize):
+                yield self.test_mapping_df.iloc[start:start + self.chunksize]
+            return
+        with self.db.reader() as conn:
+            yield from pd.read_sql(f"SELECT {columns} FROM {self.table_name} ORDER BY rowid", conn, chunksize=self.chunksize)
+
+    def query(self, sql, params=()):
+        with self.db.reader() as conn:
+            return conn.execute(sql, params).fetchall()
 
+    @metrics.timed("error_analyzer.compute_statistics")
     def compute_statistics(self):
         """
         Compute error statistics.
@@ -26,23 +101,130 @@ class ErrorAnalyzer:
         Returns:
         dict: Dictionary containing mean error, max error, standard deviation, and count of matched points.
         """
-        delta_y = self.test_mapping_df["Delta_Y"]
-        stats = {
-            "mean_error": np.mean(delta_y),
-            "max_error": np.max(delta_y),
-            "std_dev": np.std(delta_y),
-            "matched_points": len(self.test_mapping_df)
-        }
-        return stats
+        if self.test_mapping_df is not None:
+            delta_y = self.test_mapping_df["Delta_Y"]
+            stats = {
+                "mean_error": np.mean(delta_y),
+                "max_error": np.max(delta_y),
+                "std_dev": np.std(delta_y),
+                "matched_points": len(self.test_mapping_df)
+            }
+            return stats
+
+        if self.method == "stream":
+            running = RunningStats()
+            for chunk in self.iter_chunks("Delta_Y"):
+                running.update(chunk["Delta_Y"].to_numpy())
+            return running.result()
+
+        # two scans: the variance around the exact mean avoids the cancellation of E[x^2] - E[x]^2
+        count, mean, maximum = self.query(f"SELECT COUNT(Delta_Y), AVG(Delta_Y), MAX(Delta_Y) FROM {self.table_name}")[0]
+        if count == 0:
+            return RunningStats().result()
+        variance = self.query(f"SELECT AVG((Delta_Y - ?) * (Delta_Y - ?)) FROM {self.table_name}", (mean, mean))[0][0]
+        return {"mean_error": mean, "max_error": maximum, "std_dev": np.sqrt(variance), "matched_points": count}
 
+    @metrics.timed("error_analyzer.breakdown")
+    def breakdown(self):
+        """
+        Error statistics per ideal function.
+
+        Returns:
+        DataFrame: one row per Ideal_Function with matched_points, mean_error, max_error and std_dev.
+        """
+        columns = ["Ideal_Function", "matched_points", "mean_error", "max_error", "std_dev"]
+        if self.test_mapping_df is None and self.method == "sql":
+            # one grouped scan of sums around a shift close to every group's mean (the overall
+            # mean), which keeps E[d^2] - E[d]^2 free of cancellation
+            shift = self.query(f"SELECT AVG(Delta_Y) FROM {self.table_name}")[0][0] or 0.0
+            rows = self.query(f"""
+                SELECT Ideal_Function, COUNT(Delta_Y), AVG(Delta_Y), MAX(Delta_Y), AVG((Delta_Y - ?) * (Delta_Y - ?)), AVG(Delta_Y - ?)
+                FROM {self.table_name} GROUP BY Ideal_Function ORDER BY Ideal_Function
+            """, (shift, shift, shift))
+            frame = pd.DataFrame(rows, columns=columns[:4] + ["shifted_m2", "shifted_mean"])
+            frame["std_dev"] = np.sqrt(np.maximum(frame.pop("shifted_m2") - frame.pop("shifted_mean") ** 2, 0))
+            return frame
+
+        running = {}
+        for chunk in self.iter_chunks("Ideal_Function, Delta_Y"):
+            for ideal_function, group in chunk.groupby("Ideal_Function")["Delta_Y"]:
+                running.setdefault(ideal_function, RunningStats()).update(group.to_numpy())
+        rows = [{"Ideal_Function": f, **running[f].result()} for f in sorted(running)]
+        return pd.DataFrame(rows, columns=columns)
+
+    @metrics.timed("error_analyzer.histogram")
+    def histogram(self, bins=10, by_function=False):
+        """
+        Histogram of Delta_Y over equal-width bins between its min and max.
+
+        Parameters:
+        bins (int): number of bins. Defaults to 10.
+        by_function (bool): one row of counts per ideal function. Defaults to False.
+
+        Returns:
+        tuple: bin edges (bins + 1 values) and counts, a 1D array or a DataFrame indexed by Ideal_Function
+        """
+        if self.test_mapping_df is not None or self.method == "stream":
+            running = RunningStats()
+            for chunk in self.iter_chunks("Delta_Y"):
+                running.update(chunk["Delta_Y"].to_numpy())
+            low, high = running.min, running.max
+        else:
+            low, high = self.query(f"SELECT MIN(Delta_Y), MAX(Delta_Y) FROM {self.table_name}")[0]
+        if low is None or not np.isfinite(low):
+            low, high = 0.0, 0.0
+        edges = np.linspace(low, high if high > low else low + 1.0, bins + 1)
+
+        if self.test_mapping_df is not None or self.method == "stream":
+            counts = {}
+            for chunk in self.iter_chunks("Ideal_Function, Delta_Y"):
+                groups = chunk.groupby("Ideal_Function")["Delta_Y"] if by_function else [(None, chunk["Delta_Y"])]
+                for key, values in groups:
+                    counts[key] = counts.get(key, 0) + np.histogram(values.to_numpy(), bins=edges)[0]
+        else:
+            # the bin index is computed inside SQLite the way np.histogram does it: scale, truncate,
+            # then move values that rounding put on the wrong side of an edge by one bin. The edges
+            # are recomputed as i * step + low, which is how np.linspace builds them, so a value on
+            # an edge lands in the same bin as in the stream path; the top edge belongs to the last bin
+            step = (edges[-1] - edges[0]) / bins
+            group = "Ideal_Function" if by_function else "NULL"
+            rows = self.query(f"""
+                WITH binned AS (
+                    SELECT {group} AS key, Delta_Y AS d, MIN(CAST((Delta_Y - :low) * :norm AS INTEGER), :last) AS b
+                    FROM {self.table_name} WHERE Delta_Y IS NOT NULL
+                )
+                SELECT key, CASE WHEN d < b * :step + :low THEN b - 1
+                                 WHEN b < :last AND d >= (b + 1) * :step + :low THEN b + 1
+                                 ELSE b END AS bin, COUNT(*)
+                FROM binned GROUP BY 1, 2
+            """, {"low": edges[0], "norm": bins / (edges[-1] - edges[0]), "step": step, "last": bins - 1})
+            counts = {}
+            for key, index, count in rows:
+                counts.setdefault(key, np.zeros(bins, dtype=np.int64))[index] += count
+
+        if not by_function:
+            return edges, counts.get(None, np.zeros(bins, dtype=np.int64))
+        frame = pd.DataFrame.from_dict(counts, orient="index", columns=[f"bin{i}" for i in range(bins)]).sort_index()
+        frame.index.name = "Ideal_Function"
+        return edges, frame
+
+    @metrics.timed("error_analyzer.save_results")
     def save_results(self, filename="test_mapping_results.csv"):
         """
-        Save the matched data to a CSV file.
+        Save the matched data to a CSV file, appending chunk by chunk.
 
         Parameters:
         filename (str): The name of the file to save the results to. Defaults to "test_mapping_results.csv".
         """
-        self.test_mapping_df.to_csv(filename, index=False)
+        header = True
+        for chunk in self.iter_chunks():
+            chunk.to_csv(filename, index=False, header=header, mode="w" if header else "a")
+            header = False
+        if header:
+            # empty table: still write the header line
+            columns = self.test_mapping_df.columns if self.test_mapping_df is not None else \
+                [row[1] for row in self.query(f"PRAGMA table_info({self.table_name})")]
+            pd.DataFrame(columns=columns).to_csv(filename, index=False)
         print(f"Data saved as {filename}")
 
 
@@ -50,72 +232,120 @@ class Plotter:
     """
     Class for plotting test data against ideal functions.
     """
-    def __init__(self, test_mapping_df, ideal_df):
+    def __init__(self, test_mapping_df, ideal_df=None):
         """
         Initialize the Plotter with test mapping and ideal function DataFrames.
 
         Parameters:
         test_mapping_df (DataFrame): DataFrame containing test data and their corresponding matches.
-        ideal_df (DataFrame): DataFrame containing ideal function data.
+        ideal_df (DataFrame, optional): DataFrame containing ideal function data; the plots don't need it. Defaults to None.
         """
         self.test_mapping_df = test_mapping_df
         self.ideal_df = ideal_df
 
-    def plot_test_vs_ideal(self, unmatched_test_df):
+    @metrics.timed("plotter.plot_test_vs_ideal")
+    def plot_test_vs_ideal(self, unmatched_test_df, output=None, density=None, bins=512):
         """
         Plot test data versus matched ideal functions.
 
         Parameters:
         unmatched_test_df (DataFrame): DataFrame containing unmatched test data.
+        output (str, optional): PNG path; the figure is rendered headless and not shown. Defaults to None.
+        density (bool, optional): draw 2D histogram rasters instead of markers. Defaults to None
+            (only above plotting.DENSITY_THRESHOLD points).
+        bins (int, optional): raster bins per axis in density mode. Defaults to 512.
         """
-        x_vals = self.test_mapping_df["X"].values
-        y_test_vals = self.test_mapping_df["Y"].values
-        x_vals_unmatch = unmatched_test_df["X"].values
-        y_vals_unmatch = unmatched_test_df["Y_test"].values
-        y_ideal_vals = self.test_mapping_df["Best_ideal_y"].values
+        x_vals = self.test_mapping_df["X"].to_numpy(dtype=np.float64)
+        y_test_vals = self.test_mapping_df["Y"].to_numpy(dtype=np.float64)
+        x_vals_unmatch = unmatched_test_df["X"].to_numpy(dtype=np.float64)
+        y_vals_unmatch = unmatched_test_df["Y_test"].to_numpy(dtype=np.float64)
+        y_ideal_vals = self.test_mapping_df["Best_ideal_y"].to_numpy(dtype=np.float64)
 
+        # matplotlib is only imported when a plot is actually requested
+        from plotting import pyplot, draw_points, finish, use_density
+        plt = pyplot(headless=output is not None)
+        density = use_density(2 * len(x_vals) + len(x_vals_unmatch), density)
 
-        plt.figure(figsize=(8, 6))
-        plt.scatter(x_vals, y_test_vals, c="red", s=10, label="Test Data", alpha=0.7)
-        plt.scatter(x_vals, y_ideal_vals, c="green", s=10, label="Matched Ideal Function", alpha=0.7)
-        plt.scatter(x_vals_unmatch, y_vals_unmatch, c="gray", s=10, label="Unmatched X", alpha=0.7)
-        plt.yticks(np.arange(-40, 40, 5))
-        plt.xlabel("X")
-        plt.ylabel("Y")
-        plt.legend()
-        plt.title("Test Data vs. Ideal Function Matching")
-        plt.show()
+        fig, ax = plt.subplots(figsize=(8, 6))
+        draw_points(ax, x_vals, y_test_vals, density, bins, color="red", cmap="Reds", s=10, label="Test Data", alpha=0.7)
+        draw_points(ax, x_vals, y_ideal_vals, density, bins, color="green", cmap="Greens", s=10, label="Matched Ideal Function", alpha=0.7)
+        draw_points(ax, x_vals_unmatch, y_vals_unmatch, density, bins, color="gray", cmap="Greys", s=10, label="Unmatched X", alpha=0.7)
+        ax.set_yticks(np.arange(-40, 40, 5))
+        ax.set_xlabel("X")
+        ax.set_ylabel("Y")
+        ax.legend()
+        ax.set_title("Test Data vs. Ideal Function Matching")
+        finish(plt, fig, output, name="test_vs_ideal")
 
 
 class Visualizer:
     """
     Class to manage the visualization process.
     """
-    def __init__(self, db_connector):
+    def __init__(self, db_connector, method="sql", chunksize=100000):
         """
         Initialize the Visualizer with a database connector.
 
         Parameters:
         db_connector: Database connection instance.
+        method (str): statistics through SQLite aggregates ("sql") or a streaming pass ("stream"). Defaults to "sql".
+        chunksize (int): rows per chunk for streaming and the csv export. Defaults to 100000.
         """
         self.db = db_connector
+        self._plotter = None
         try:
-            self.test_mapping_df = pd.read_sql("SELECT * FROM test_mapping", self.db.conn)
-            self.ideal_df = pd.read_sql("SELECT * FROM ideal_functions", self.db.conn)
+            with metrics.stage("visualizer.load"):
+                preview = pd.read_sql("SELECT * FROM test_mapping ORDER BY rowid LIMIT 10", self.db.conn)
         except Exception as e:
             raise DataLoadingError(f"Failed to load data in visualizer: {e}")
-        
-        self.analyzer = ErrorAnalyzer(self.test_mapping_df)
-        self.plotter = Plotter(self.test_mapping_df, self.ideal_df)
 
-        print("Loaded stored matching data", self.test_mapping_df.head(10))
+        # statistics and the csv export read test_mapping in SQL/chunks; only plotting loads it whole
+        self.analyzer = ErrorAnalyzer(db_connector=self.db, method=method, chunksize=chunksize)
 
-    def run(self, unmatched_test_df):
+        print("Loaded stored matching data", preview)
+
+    @property
+    def plotter(self):
         """
-        Execute the visualization process.
+        Plotter over the full test_mapping table, loaded on first use.
+        """
+        if self._plotter is None:
+            try:
+                test_mapping_df = Dataloader(self.db, "test_mapping").df
+            except Exception as e:
+                raise DataLoadingError(f"Failed to load data in visualizer: {e}")
+            self._plotter = Plotter(test_mapping_df)
+        return self._plotter
+
+    def load_unmatched(self):
+        """
+        Load the test points that have no row in test_mapping, without re-running the matcher.
+
+        Returns:
+        DataFrame: unmatched test data with columns X and Y_test.
+        """
+        try:
+            with self.db.reader() as conn:
+                # an anti-join rather than NOT EXISTS: SQLite builds a temporary index on
+                # test_mapping(X, Y) for the join, where the correlated subquery scanned the
+                # whole table once per test point
+                return pd.read_sql("""
+                    SELECT t.x AS X, t.y AS Y_test FROM test_data t
+                    LEFT JOIN test_mapping m ON m.X = t.x AND m.Y = t.y
+                    WHERE m.X IS NULL
+                    ORDER BY t.rowid
+                """, conn)
+        except Exception as e:
+            raise DataLoadingError(f"Failed to load unmatched test data in visualizer: {e}")
+
+    def report(self, bins=10, filename="test_mapping_results.csv"):
+        """
+        Print the error statistics, the per-function breakdown and the Delta_Y histogram, then save
+        the matched data to CSV.
 
         Parameters:
-        unmatched_test_df (DataFrame): DataFrame containing unmatched test data.
+        bins (int): histogram bins. Defaults to 10.
+        filename (str): csv output. Defaults to "test_mapping_results.csv".
         """
         stats = self.analyzer.compute_statistics()
         print(f"Mean error: {stats['mean_error']:.6f}")
@@ -123,13 +353,35 @@ class Visualizer:
         print(f"Standard deviation of error: {stats['std_dev']:.6f}")
         print(f"Total number of matched test points: {stats['matched_points']}")
 
-        self.analyzer.save_results()
-        self.plotter.plot_test_vs_ideal(unmatched_test_df)
+        print("Error per ideal function:")
+        print(self.analyzer.breakdown().to_string(index=False))
+
+        edges, counts = self.analyzer.histogram(bins)
+        print("Delta_Y histogram:")
+        widest = max(counts.max(), 1)
+        for low, high, count in zip(edges[:-1], edges[1:], counts):
+            print(f"  [{low:9.6f}, {high:9.6f}) {count:10d} {'#' * int(round(40 * count / widest))}")
+
+        self.analyzer.save_results(filename)
+
+    def run(self, unmatched_test_df=None, output=None, density=None):
+        """
+        Execute the visualization process.
+
+        Parameters:
+        unmatched_test_df (DataFrame, optional): DataFrame containing unmatched test data. Loaded from the database if omitted.
+        output (str, optional): PNG path for the plot instead of showing it. Defaults to None.
+        density (bool, optional): see Plotter.plot_test_vs_ideal. Defaults to None.
+        """
+        self.report()
+        if unmatched_test_df is None:
+            unmatched_test_df = self.load_unmatched()
+        self.plotter.plot_test_vs_ideal(unmatched_test_df, output=output, density=density)
 
 
 
-def main():
-    db_connector = DBConnector(db_path="/Users/lincong/Desktop/python_course/assignment/Dataset/functions.db")
+def main(db_path=DEFAULT_DB_PATH, store_dir=DEFAULT_STORE_DIR):
+    db_connector = DBConnector(db_path=db_path, store_dir=store_dir)
 
     train_loader = TrainDataloader(db_connector)
     train_loader.viz_df()
@@ -144,6 +396,7 @@ def main():
     visualizer = Visualizer(db_connector)
     visualizer.run(pd.DataFrame(unmatched_test_data, columns=["X", "Y_test", "Delta_Y", "Ideal_Function", "Y_ideal"]))
 
-    db_connector.conn.close()
+    db_connector.close()
 
-main()
\ No newline at end of file
+if __name__ == "__main__":
+    main()